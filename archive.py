@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import threading
+import time
+from utils import get_user_data_dir
+
+class DownloadArchive:
+    """
+    Every completed media download as (extractor, video id, format), in SQLite so a
+    2,000-item channel can be checked in one indexed query. Playlist runs skip the
+    entries found here and only fetch what is new.
+    The avoid-transcoding setting is deliberately not part of the key: it changes the
+    file type, not the content, and toggling it shouldn't fetch a whole channel again.
+    """
+    def __init__(self, filename="archive.db"):
+        self.filename = os.path.join(get_user_data_dir(), filename)
+        self.lock = threading.Lock() # one connection, used from every download thread
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS archive (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                format TEXT NOT NULL,
+                title TEXT,
+                completed REAL NOT NULL,
+                PRIMARY KEY (extractor, video_id, format)
+            ) WITHOUT ROWID""")
+
+    def add(self, extractor, video_id, format_type, title=None):
+        if not extractor or not video_id:
+            return
+        try:
+            with self.lock, self.db:
+                self.db.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?)",
+                                (extractor.lower(), str(video_id), format_type, title, time.time()))
+        except sqlite3.Error as e:
+            print(f"Error saving to archive: {e}")
+
+    def known(self, extractor, ids, format_type):
+        """The subset of ids already downloaded from this extractor in this format."""
+        ids = [str(video_id) for video_id in ids]
+        found = set()
+        try:
+            with self.lock:
+                # Stay under SQLite's limit on query parameters
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    rows = self.db.execute(
+                        f"SELECT video_id FROM archive WHERE extractor = ? AND format = ? AND video_id IN ({','.join('?' * len(chunk))})",
+                        (extractor.lower(), format_type, *chunk))
+                    found.update(row[0] for row in rows)
+        except sqlite3.Error as e:
+            print(f"Error reading archive: {e}")
+        return found
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,201 @@
+"""
+Benchmark for SegmentedFileDownloader against a local range server.
+
+Runs every combination of file size, thread count and block size (each case in a
+fresh process, so CPU time and peak RSS belong to that download alone) and writes
+the results as JSON:
+
+    python benchmarks/bench_download.py --sizes 1K,64M,4G --threads auto,1,8 --block-sizes 64K,1M
+    python benchmarks/bench_download.py --latency 0.05 --bandwidth 5M --drop-rate 0.05 -o results.json
+
+Test files are sparse, so multi-GB sizes cost almost no disk space on the serving
+side. The downloads themselves are written to --target-dir (default: the temp dir).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from range_server import RangeServer, parse_size
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKER_INTERVAL = 1024 * 1024 # every MiB of a test file starts with its own offset
+PROGRESS_INTERVAL = 0.1 # same rate as the UI tick (main.PROGRESS_INTERVAL_MS)
+RESULT_PREFIX = 'RESULT '
+
+def make_test_file(path, size):
+    """Sparse file with an 8-byte offset marker every MiB, so misplaced blocks are caught."""
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for offset in range(0, size - 7, MARKER_INTERVAL):
+            f.seek(offset)
+            f.write(offset.to_bytes(8, 'big'))
+
+def verify_file(path, size):
+    if os.path.getsize(path) != size:
+        return False
+    with open(path, 'rb') as f:
+        for offset in range(0, size - 7, MARKER_INTERVAL):
+            f.seek(offset)
+            if f.read(8) != offset.to_bytes(8, 'big'):
+                return False
+    return True
+
+def peak_rss_mib():
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_case(case):
+    """Runs in the child process: one download, measured."""
+    sys.path.insert(0, REPO_ROOT)
+    from downloader_generic import SegmentedFileDownloader
+
+    downloader = SegmentedFileDownloader(num_threads=case['threads'], block_size=case['block_size'])
+    callbacks = {'title': 0, 'completion': 0, 'error': 0}
+    done = threading.Event()
+    errors = []
+
+    def on_title(name):
+        callbacks['title'] += 1
+    def on_complete(name):
+        callbacks['completion'] += 1
+        done.set()
+    def on_error(message):
+        callbacks['error'] += 1
+        errors.append(message)
+        done.set()
+
+    out_dir = tempfile.mkdtemp(prefix='qd-bench-', dir=case['target_dir'])
+    try:
+        cpu_before = os.times()
+        started = time.perf_counter()
+        downloader.download(case['url'], out_dir, on_complete, on_error, on_title)
+        # Poll like the UI tick does, so its cost shows up in the numbers
+        polls = 0
+        while not done.wait(PROGRESS_INTERVAL):
+            downloader.get_progress()
+            polls += 1
+        elapsed = time.perf_counter() - started
+        downloader.download_thread.join()
+        cpu_after = os.times()
+
+        path = os.path.join(out_dir, os.path.basename(case['url']))
+        ok = not errors and verify_file(path, case['size'])
+        size_mib = case['size'] / (1024 * 1024)
+        return {
+            'ok': ok,
+            'error': errors[0] if errors else None,
+            'seconds': round(elapsed, 4),
+            'throughput_mib_s': round(size_mib / elapsed, 2) if elapsed else None,
+            'cpu_seconds': round((cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system), 4),
+            'peak_rss_mib': peak_rss_mib(),
+            'callbacks': callbacks,
+            'progress_polls': polls,
+            'retries': downloader.max_retries - downloader.retries_left,
+        }
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def run_in_child(case, timeout):
+    cmd = [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'ok': False, 'error': f'timed out after {timeout}s'}
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {'ok': False, 'error': (proc.stderr.strip().splitlines() or ['no result'])[-1]}
+
+def parse_threads(text):
+    return [None if t.strip() == 'auto' else int(t) for t in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1K,1M,64M,1G', help='comma-separated file sizes')
+    parser.add_argument('--threads', default='auto,1,4,8', help="comma-separated thread counts, 'auto' = tuned")
+    parser.add_argument('--block-sizes', default='64K,1M', help='comma-separated read block sizes')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per combination')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', default='0', help='per-connection cap, e.g. 5M (bytes/s)')
+    parser.add_argument('--drop-rate', type=float, default=0, help='chance of cutting a response off')
+    parser.add_argument('--ignore-range', action='store_true', help='server sends the whole file every time')
+    parser.add_argument('--target-dir', default=None, help='where downloads are written (e.g. a USB disk)')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds per case')
+    parser.add_argument('-o', '--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(RESULT_PREFIX + json.dumps(run_case(json.loads(args.case))), flush=True)
+        return
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    threads = parse_threads(args.threads)
+    block_sizes = [parse_size(s) for s in args.block_sizes.split(',')]
+    shaping = {
+        'latency': args.latency,
+        'bandwidth': parse_size(args.bandwidth),
+        'drop_rate': args.drop_rate,
+        'ignore_range': args.ignore_range,
+    }
+
+    serve_dir = tempfile.mkdtemp(prefix='qd-bench-src-')
+    server = RangeServer(serve_dir, **shaping).start()
+    results = []
+    try:
+        for size in sizes:
+            name = f'{size}.bin'
+            make_test_file(os.path.join(serve_dir, name), size)
+            for thread_count in threads:
+                for block_size in block_sizes:
+                    for run in range(args.repeat):
+                        case = {
+                            'url': server.url + name,
+                            'size': size,
+                            'threads': thread_count,
+                            'block_size': block_size,
+                            'target_dir': args.target_dir,
+                        }
+                        server.reset_stats()
+                        result = dict(case, run=run, **shaping)
+                        del result['url'], result['target_dir']
+                        result.update(run_in_child(case, args.timeout))
+                        result['server_requests'] = server.requests
+                        result['server_drops'] = server.drops
+                        results.append(result)
+                        print(f"size={size} threads={thread_count or 'auto'} block={block_size}: "
+                              f"{result.get('throughput_mib_s')} MiB/s, cpu {result.get('cpu_seconds')}s"
+                              + ('' if result['ok'] else f" FAILED ({result['error']})"), file=sys.stderr)
+            os.remove(os.path.join(serve_dir, name))
+    finally:
+        server.shutdown()
+        shutil.rmtree(serve_dir, ignore_errors=True)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Local HTTP server for benchmarking the file downloader.
+Serves the files in a directory with Range support and can shape each connection
+(extra latency, bandwidth cap), drop connections mid-body or ignore Range altogether.
+
+    python benchmarks/range_server.py DIR --port 8000 --latency 0.05 --bandwidth 10M
+"""
+import argparse
+import email.utils
+import os
+import random
+import re
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RANGE = re.compile(r'bytes=(\d+)-(\d*)$')
+CHUNK_SIZE = 256 * 1024
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like a real server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, head=False):
+        server = self.server
+        path = os.path.join(server.root, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        start, end, status = 0, size - 1, 200
+
+        m = RANGE.match(self.headers.get('Range', ''))
+        if m and not server.ignore_range:
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        if server.latency:
+            time.sleep(server.latency)
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes') # also when ignoring it, like the servers that lie
+        self.send_header('ETag', f'"{size:x}-{int(stat.st_mtime):x}"')
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not head:
+            server.count_request()
+            self._send_body(path, start, end - start + 1)
+
+    def _send_body(self, path, offset, length):
+        server = self.server
+        drop_at = random.randrange(length) if length and random.random() < server.drop_rate else None
+        chunk_size = CHUNK_SIZE
+        if server.bandwidth:
+            chunk_size = max(4096, min(CHUNK_SIZE, server.bandwidth // 20)) # smooth pacing
+        view = memoryview(bytearray(chunk_size))
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while sent < length:
+                n = f.readinto(view[:min(chunk_size, length - sent)])
+                if not n:
+                    break
+                if drop_at is not None and sent + n > drop_at:
+                    server.count_drop()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+                try:
+                    self.wfile.write(view[:n])
+                except OSError:
+                    self.close_connection = True # the client went away
+                    return
+                sent += n
+                if server.bandwidth:
+                    ahead = sent / server.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+class RangeServer(ThreadingHTTPServer):
+    """
+    latency: seconds added before every response.
+    bandwidth: bytes/s per connection, 0 = unlimited.
+    drop_rate: chance (0-1) that a response body is cut off at a random point.
+    ignore_range: answer every request with the whole file and a 200.
+    """
+    daemon_threads = True
+
+    def __init__(self, root, port=0, latency=0, bandwidth=0, drop_rate=0, ignore_range=False):
+        super().__init__(('127.0.0.1', port), RangeRequestHandler)
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.ignore_range = ignore_range
+        self.requests = 0
+        self.drops = 0
+        self.stats_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        pass # clients hanging up on keep-alive connections are expected here
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/'
+
+    def count_request(self):
+        with self.stats_lock:
+            self.requests += 1
+
+    def count_drop(self):
+        with self.stats_lock:
+            self.drops += 1
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests = self.drops = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def parse_size(text):
+    """'64K', '1.5M', '4G' -> bytes."""
+    text = text.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='directory with the files to serve')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', default='0', help='per-connection cap, e.g. 5M (bytes/s)')
+    parser.add_argument('--drop-rate', type=float, default=0, help='chance of cutting a response off')
+    parser.add_argument('--ignore-range', action='store_true', help='always send the whole file')
+    args = parser.parse_args()
+
+    server = RangeServer(args.root, args.port, args.latency, parse_size(args.bandwidth), args.drop_rate, args.ignore_range)
+    print(f"Serving {args.root} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
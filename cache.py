@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from utils import get_user_data_dir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows: no reflinks, hardlink or copy instead
+
+READ_SIZE = 1024 * 1024
+FICLONE = 0x40049409 # Linux ioctl: share another file's blocks copy-on-write (btrfs, XFS)
+
+def file_key(url, headers, size):
+    """Cache key for a direct file, None if the server gives nothing to tell versions apart."""
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return None
+    return f"file|{url}|{etag or ''}|{last_modified or ''}|{size}"
+
+def media_key(url, format_type, quality, avoid_transcoding=False):
+    # Without transcoding the same choice gives other file types (.m4a/.opus, .mkv)
+    mode = "|copy" if avoid_transcoding else ""
+    return f"media|{url}|{format_type}|{quality}{mode}"
+
+class DownloadCache:
+    """
+    Opt-in cache of completed downloads, shared by every output folder.
+    Each file is stored once under its SHA-256 and found by key (URL plus validators
+    for files, URL plus the chosen format for media) or directly by that hash.
+    Hits are placed in the target folder as a reflink, hardlink or copy, in that
+    order of preference. The least recently used files go first once the cache
+    grows past max_size.
+    """
+    def __init__(self, max_size, directory=None):
+        self.directory = directory or os.path.join(get_user_data_dir(), 'cache')
+        self.objects_dir = os.path.join(self.directory, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.max_size = max_size # bytes
+        self.lock = threading.Lock()
+        self.index = self.load_index()
+
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return {'keys': {}, 'objects': {}}
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except:
+            return {'keys': {}, 'objects': {}}
+
+    def save_index(self):
+        try:
+            with open(self.index_file, 'w') as f:
+                json.dump(self.index, f, indent=4)
+        except Exception as e:
+            print(f"Error saving cache index: {e}")
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self._evict()
+            self.save_index()
+
+    def lookup(self, key):
+        """Returns {'path', 'name', 'title', 'size', 'extractor', 'video_id'} for a cached file, or None."""
+        if not key:
+            return None
+        with self.lock:
+            entry = self.index['keys'].get(key)
+            return self._hit(entry['hash'], entry) if entry else None
+
+    def lookup_hash(self, digest):
+        with self.lock:
+            return self._hit(digest.lower(), {})
+
+    def place(self, hit, target):
+        """Put a cached file at target, sharing storage with the cache where the filesystem allows."""
+        method = self._place(hit['path'], target)
+        print(f"Served {os.path.basename(target)} from the cache ({method})")
+
+    def admit(self, key, path, title=None, digest=None, extractor=None, video_id=None):
+        """Add a completed download. digest: its SHA-256 if already known; extractor/video_id: for media."""
+        size = os.path.getsize(path)
+        if size > self.max_size:
+            return
+        digest = (digest or self._sha256(path)).lower()
+        target = os.path.join(self.objects_dir, digest)
+        with self.lock:
+            known = digest in self.index['objects']
+        if not known:
+            self._place(path, target)
+        with self.lock:
+            if digest not in self.index['objects']:
+                self.index['objects'][digest] = {
+                    'size': size,
+                    'mtime': os.stat(target).st_mtime,
+                    'name': os.path.basename(path),
+                    'last_used': time.time(),
+                }
+            if key:
+                self.index['keys'][key] = {'hash': digest, 'name': os.path.basename(path), 'title': title,
+                                           'extractor': extractor, 'video_id': video_id}
+            self._evict()
+            self.save_index()
+
+    def _hit(self, digest, entry):
+        obj = self.index['objects'].get(digest)
+        if not obj:
+            return None
+        path = os.path.join(self.objects_dir, digest)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if not stat or stat.st_size != obj['size'] or stat.st_mtime != obj['mtime']:
+            # Gone, or edited in place through a hardlink: no longer what was cached
+            self._drop(digest)
+            self.save_index()
+            return None
+        obj['last_used'] = time.time()
+        self.save_index()
+        return {'path': path, 'name': entry.get('name') or obj['name'], 'title': entry.get('title'), 'size': obj['size'],
+                'extractor': entry.get('extractor'), 'video_id': entry.get('video_id')}
+
+    def _evict(self):
+        objects = self.index['objects']
+        total = sum(obj['size'] for obj in objects.values())
+        for digest in sorted(objects, key=lambda d: objects[d]['last_used']):
+            if total <= self.max_size:
+                break
+            total -= objects[digest]['size']
+            self._drop(digest)
+
+    def _drop(self, digest):
+        self.index['objects'].pop(digest, None)
+        self.index['keys'] = {k: v for k, v in self.index['keys'].items() if v['hash'] != digest}
+        try:
+            os.remove(os.path.join(self.objects_dir, digest))
+        except OSError:
+            pass
+
+    def _place(self, source, target):
+        tmp = f"{target}.{threading.get_ident()}.tmp"
+        for name, method in (('reflink', self._reflink), ('hardlink', os.link), ('copy', shutil.copyfile)):
+            try:
+                method(source, tmp)
+                os.replace(tmp, target)
+                return name
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        raise OSError(f"Could not copy {source} to {target}")
+
+    def _reflink(self, source, target):
+        if fcntl is None:
+            raise OSError("reflinks not supported")
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+    def _sha256(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
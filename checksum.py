@@ -0,0 +1,76 @@
+import hashlib
+import threading
+
+READ_SIZE = 1024 * 1024
+
+# Digest lengths (hex chars) for checksums given without an algorithm prefix
+ALGORITHMS_BY_LENGTH = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+class ChecksumMismatch(Exception):
+    pass
+
+def parse_checksum(text):
+    """
+    Parse 'sha256:<hex>' or a bare hex digest (algorithm guessed from its length).
+    Returns (algorithm, hexdigest), None for empty input, raises ValueError if invalid.
+    """
+    text = (text or "").strip().lower()
+    if not text:
+        return None
+    if ":" in text:
+        algorithm, digest = text.split(":", 1)
+    else:
+        algorithm, digest = ALGORITHMS_BY_LENGTH.get(len(text)), text
+    try:
+        int(digest, 16)
+        hashlib.new(algorithm)
+    except (ValueError, TypeError):
+        raise ValueError(f"Not a valid checksum: {text}")
+    return algorithm, digest
+
+class StreamingHasher:
+    """
+    Hashes a file front to back while its segments land out of order.
+    The worker writing at the hash cursor feeds its buffers straight in; bytes that
+    landed further ahead are read back from disk (still in the page cache) once
+    everything before them is complete.
+    """
+    def __init__(self, checksum, filepath):
+        self.algorithm, self.expected = checksum
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hash = hashlib.new(self.algorithm)
+        self.offset = 0 # everything before this has been hashed
+
+    def feed(self, offset, data):
+        # Never make a network worker wait; whatever it skips is caught up from disk
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if offset == self.offset:
+                self.hash.update(data)
+                self.offset += len(data)
+        finally:
+            self.lock.release()
+
+    def catch_up(self, limit):
+        """Hash bytes already on disk up to `limit`, the end of the completed prefix."""
+        with self.lock:
+            if self.offset >= limit:
+                return
+            with open(self.filepath, 'rb') as f:
+                f.seek(self.offset)
+                while self.offset < limit:
+                    data = f.read(min(READ_SIZE, limit - self.offset))
+                    if not data:
+                        break
+                    self.hash.update(data)
+                    self.offset += len(data)
+
+    def verify(self):
+        actual = self.hash.hexdigest()
+        if actual != self.expected:
+            raise ChecksumMismatch(f"Checksum mismatch: expected {self.algorithm} {self.expected}, got {actual}")
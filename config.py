@@ -11,7 +11,12 @@ class ConfigManager:
     def load_config(self):
         default_config = {
             "default_path": os.path.join(os.path.expanduser("~"), "Downloads", "quick_downloader"),
-            "theme": "System"
+            "theme": "System",
+            "speed_limit": 0, # KB/s across all downloads, 0 = unlimited
+            "cache_size": 0, # GB for the shared download cache, 0 = off
+            "playlist_workers": 3, # playlist items downloaded at the same time
+            "media_profile": "Auto", # fragment concurrency for HLS/DASH, see media_profile.py
+            "avoid_transcoding": False # keep AAC/Opus audio and merge into mkv instead of re-encoding
         }
         
         if not os.path.exists(self.filename):
@@ -1,27 +1,89 @@
-import yt_dlp
+import copy
 import os
 import threading
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from ratelimit import bandwidth_limiter
+from cache import media_key
+from ydl_pool import ydl_pool
+from postprocess import post_processor, passthrough_audio
+from media_profile import DEFAULT_PROFILE, PROFILES, MIN_SAMPLE_SECONDS, fragment_tuner, profile_options, http_status
+
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+def strip_ansi(text):
+    return ANSI_ESCAPE.sub('', text)
+
+PLAYLIST_WORKERS = 3 # playlist items downloaded at the same time
+PASSTHROUGH_HEADROOM = 1.25 # keep audio up to this much above the chosen bitrate rather than re-encode it
 
 class MediaDownloader:
-    def __init__(self, ffmpeg_path=None):
+    def __init__(self, ffmpeg_path=None, speed_limit=0, cache=None, metadata_cache=None, playlist_workers=PLAYLIST_WORKERS, media_profile=DEFAULT_PROFILE, avoid_transcoding=False, archive=None):
         self.ffmpeg_path = ffmpeg_path
+        self.cache = cache # DownloadCache, None = off
+        self.metadata_cache = metadata_cache # MetadataCache, skips extraction for URLs seen recently
+        self.archive = archive # DownloadArchive, lets playlist runs skip what was already downloaded
+        self.format_type = None
+        self.skipped = 0 # playlist entries found in the archive
+        self.speed_limit = speed_limit # bytes/s, 0 = only the global limit applies
+        self.playlist_workers = playlist_workers
+        self.media_profile = media_profile # fragment concurrency and chunking, see media_profile.py
+        self.playlist_title = None
+        self.playlist_items = None # entry dicts with per-item state and progress, playlists only
+        self._playlist_started = None
+        self.avoid_transcoding = avoid_transcoding # prefer streams that can be copied as they are
+        self.audio_target = None # (codec, kbps) to convert to after the download, Audio only
+        self.passthrough_kbps = None # highest audio bitrate kept without re-encoding, None = always convert
+        self.processing = False # downloading is over, waiting for ffmpeg
+        self.throttle = None
+        self._seen_bytes = {} # filename -> downloaded_bytes at the last hook call
         self._cancel_requested = False
+        self._running = threading.Event() # cleared while paused
+        self._running.set()
         self.download_thread = None
         self.current_filename = None
+        self.progress = None # latest (progress, speed, eta), polled by the UI
 
     def cancel(self):
         self._cancel_requested = True
 
-    def _progress_hook(self, d, progress_callback, title_callback=None):
+    def pause(self):
+        """Stop yt-dlp at its next block, keeping the .part file; resume() picks it up from there."""
+        self._running.clear()
+        if self.throttle:
+            bandwidth_limiter.set_paused(self.throttle, True)
+
+    def resume(self):
+        if self.throttle:
+            bandwidth_limiter.set_paused(self.throttle, False)
+        self._running.set()
+
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def is_processing(self):
+        return self.processing
+
+    def get_progress(self):
+        return self.progress
+
+    def _progress_hook(self, d, title_callback=None, item=None):
         if self._cancel_requested:
             raise Exception("Download cancelled by user")
+        if self.is_paused() and d['status'] == 'downloading':
+            # Unwinds yt-dlp and closes its connection; the .part file stays for the resume
+            raise Exception("Download paused")
         
         if d['status'] == 'downloading':
+            self._throttle(d)
+            if item is not None:
+                self._item_progress(d, item)
+                return
             try:
                 if title_callback:
                     filename = d.get('filename')
-                    if filename:
+                    if filename and filename != self.current_filename:
                         self.current_filename = filename # Track for cleanup
                         title_callback(os.path.basename(filename))
 
@@ -33,10 +95,6 @@ class MediaDownloader:
                 else:
                     progress = 0
                 
-                def strip_ansi(text):
-                    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-                    return ansi_escape.sub('', text)
-
                 # Use yt-dlp's formatted strings if available, otherwise fallback
                 speed = d.get('_speed_str', 'N/A')
                 if speed == 'N/A' and d.get('speed'):
@@ -50,14 +108,32 @@ class MediaDownloader:
                 else:
                     eta = strip_ansi(eta)
                 
-                if progress_callback:
-                    progress_callback(progress, speed, eta)
+                self.progress = (progress, speed, eta)
             except Exception as e:
                 print(f"Progress Error: {e}")
                 pass
 
-    def download(self, url, options, output_path, quality, format_type, progress_callback=None, completion_callback=None, error_callback=None, title_callback=None):
+    def _item_progress(self, d, item):
+        item['filename'] = d.get('filename') or item['filename'] # Track for cleanup
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        item['progress'] = min(1.0, d.get('downloaded_bytes', 0) / total) if total else 0.0
+        item['speed'] = d.get('speed') or 0
+        self.progress = self._playlist_progress()
+
+    def _throttle(self, d):
+        # yt-dlp calls the hook after every block it reads, so sleeping here paces the transfer
+        downloaded = d.get('downloaded_bytes') or 0
+        key = d.get('filename')
+        last = self._seen_bytes.get(key, 0)
+        self._seen_bytes[key] = downloaded
+        if downloaded > last:
+            self.throttle.consume(downloaded - last, lambda: self._cancel_requested)
+
+    def download(self, url, options, output_path, quality, format_type, completion_callback=None, error_callback=None, title_callback=None):
         self._cancel_requested = False
+        self.progress = None
+        self.processing = False
+        self.format_type = format_type
         
         def run():
             ydl_opts = options.copy()
@@ -83,6 +159,10 @@ class MediaDownloader:
                 elif quality == "480p":
                     ydl_opts['format'] = 'bestvideo[height<=480]+bestaudio/best'
                 ydl_opts['merge_output_format'] = 'mp4'
+                if self.avoid_transcoding:
+                    # At equal resolution take mp4/m4a streams; anything that won't fit mp4 goes into mkv as is
+                    ydl_opts['format_sort'] = ['res', 'ext:mp4:m4a']
+                    ydl_opts['merge_output_format'] = 'mp4/mkv'
             
             elif format_type == "Audio":
                 ydl_opts['format'] = 'bestaudio/best'
@@ -96,19 +176,31 @@ class MediaDownloader:
                 elif quality == "Low (128kbps)":
                     audio_quality = '128'
                 
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': audio_quality,
-                }]
-
-            # Add progress hook
-            ydl_opts['progress_hooks'] = [lambda d: self._progress_hook(d, progress_callback, title_callback)]
-            
+                # Converted by post_processor afterwards, so the transcode doesn't hold up the download
+                self.audio_target = ('mp3', audio_quality)
+                if self.avoid_transcoding:
+                    # Re-encoding a lossy stream can't improve it: keep AAC/Opus/MP3 unless a smaller file was asked for
+                    self.passthrough_kbps = float('inf') if quality == "Best" else int(audio_quality) * PASSTHROUGH_HEADROOM
+                    if quality != "Best":
+                        ydl_opts['format'] = f'bestaudio[abr<={audio_quality}]/bestaudio/best'
+                    ydl_opts['format_sort'] = ['ext:m4a:opus']
+
+            self.throttle = bandwidth_limiter.register(self.speed_limit)
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    title = info.get('title', 'Unknown Title')
+                entries, single = (None, None) if options.get('noplaylist') else self._expand_playlist(url, ydl_opts)
+                if entries is not None:
+                    title = self._download_playlist(entries, ydl_opts, output_path, quality, format_type, title_callback)
+                else:
+                    # Playlists aren't cached as a whole, only single videos
+                    cache_key = media_key(url, format_type, quality, self.avoid_transcoding) if self.cache and options.get('noplaylist') else None
+                    title, job = self._fetch(url, ydl_opts, cache_key, output_path,
+                                             lambda d: self._progress_hook(d, title_callback), title_callback, single)
+                    if job:
+                        bandwidth_limiter.unregister(self.throttle) # the network part is over
+                        self.processing = True
+                        self.current_filename = job.result()
+                        if title_callback:
+                            title_callback(os.path.basename(self.current_filename))
                     
                 if completion_callback:
                     completion_callback(title)
@@ -121,19 +213,289 @@ class MediaDownloader:
                     if error_callback:
                         error_callback(str(e))
                     self._cleanup()
+            finally:
+                bandwidth_limiter.unregister(self.throttle)
 
         self.download_thread = threading.Thread(target=run)
         self.download_thread.start()
 
+    def _fetch(self, url, ydl_opts, cache_key, output_path, progress_hook, title_callback=None, entry=None):
+        """
+        Download one video (from the cache if it has it). Returns its title and, if it
+        still needs converting, the post-processing Future of the final file's path.
+        entry: its flat playlist entry, or its raw extraction if that was already done.
+        """
+        hit = self.cache.lookup(cache_key) if cache_key else None
+        if hit:
+            if title_callback:
+                title_callback(hit['name'])
+            self.cache.place(hit, os.path.join(output_path, hit['name']))
+            # Entries cached before ids were stored: the playlist entry still knows them
+            entry = entry or {}
+            self._record({'extractor_key': hit['extractor'] or entry.get('ie_key') or entry.get('extractor_key'),
+                          'id': hit['video_id'] or entry.get('id'), 'title': hit['title']})
+            return hit['title'] or hit['name'], None
+
+        ydl_opts = dict(ydl_opts, **profile_options(self.media_profile, url))
+        fragments = ydl_opts['concurrent_fragment_downloads']
+        samples = {} # filename -> (bytes, seconds) of its fragmented download
+
+        def hook(d):
+            if d['status'] == 'downloading' and d.get('fragment_index') is not None and d.get('elapsed'):
+                samples[d.get('filename')] = (d.get('downloaded_bytes') or 0, d['elapsed'])
+            progress_hook(d)
+
+        try:
+            info = self._run_ydl(url, ydl_opts, hook, entry)
+        except Exception as e:
+            # Only 429 means too many requests; a 403 on YouTube is usually an expired signature
+            if self.media_profile not in PROFILES and http_status(e) == 429:
+                fragment_tuner.back_off(url, fragments)
+            raise
+        elapsed = sum(seconds for _, seconds in samples.values())
+        if self.media_profile not in PROFILES and elapsed >= MIN_SAMPLE_SECONDS:
+            fragment_tuner.report(url, fragments, sum(size for size, _ in samples.values()) / elapsed)
+        title = info.get('title', 'Unknown Title')
+        path = self._downloaded_file(info)
+        if not path:
+            return title, None
+        if not self.audio_target:
+            if cache_key:
+                self._admit_to_cache(cache_key, path, info)
+            self._record(info)
+            return title, None
+
+        ext = passthrough_audio(info['requested_downloads'][0], self.passthrough_kbps) if self.passthrough_kbps else None
+        if ext and path.endswith('.' + ext):
+            if cache_key:
+                self._admit_to_cache(cache_key, path, info)
+            self._record(info)
+            return title, None
+        if ext:
+            job = post_processor.remux_audio(path, ext, self.ffmpeg_path, lambda: self._cancel_requested)
+        else:
+            codec, bitrate = self.audio_target
+            job = post_processor.extract_audio(path, codec, bitrate, self.ffmpeg_path, lambda: self._cancel_requested)
+        job.add_done_callback(lambda f: f.cancelled() or f.exception() or self._processed(f.result(), info, cache_key))
+        return title, job
+
+    def _processed(self, path, info, cache_key):
+        if cache_key:
+            self._admit_to_cache(cache_key, path, info)
+        self._record(info)
+
+    def _record(self, info):
+        if self.archive:
+            self.archive.add(info.get('extractor_key') or info.get('extractor'), info.get('id'), self.format_type, info.get('title'))
+
+    def _expand_playlist(self, url, ydl_opts):
+        """
+        (entries, None) for a playlist URL, listed with one request. (None, its raw
+        extraction) for a single video, so it isn't extracted a second time.
+        """
+        with ydl_pool.get(dict(ydl_opts, extract_flat='in_playlist')) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type', 'video') == 'video':
+                return None, info
+            # Flattening happens while processing; the entries stay unresolved
+            info = ydl.process_ie_result(info, download=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            return None, None
+        self.playlist_title = info.get('title') or url
+        entries = []
+        for entry in info.get('entries') or []:
+            entry_url = entry and (entry.get('url') or entry.get('webpage_url'))
+            if entry_url:
+                entries.append({'url': entry_url, 'title': entry.get('title'), 'id': entry.get('id'),
+                                'ie_key': entry.get('ie_key'), 'entry': entry, 'state': 'queued', 'progress': 0.0,
+                                'speed': 0, 'filename': None})
+        return entries, None
+
+    def _download_playlist(self, entries, ydl_opts, output_path, quality, format_type, title_callback=None):
+        """Download the entries on a few workers at once; one failing entry doesn't stop the rest."""
+        if title_callback:
+            title_callback(self.playlist_title)
+        if self.archive:
+            entries = self._skip_archived(entries)
+        if not entries:
+            return f"{self.playlist_title} (no new items)" if self.skipped else self.playlist_title
+        self.playlist_items = entries
+        self._playlist_started = time.monotonic()
+        item_opts = dict(ydl_opts, noplaylist=True)
+        errors = []
+
+        def fetch(item):
+            if self._cancel_requested:
+                return
+            item['state'] = 'downloading'
+            cache_key = media_key(item['url'], format_type, quality, self.avoid_transcoding) if self.cache else None
+            try:
+                item['title'], job = self._fetch(item['url'], item_opts, cache_key, output_path,
+                                                 lambda d: self._progress_hook(d, item=item), entry=item['entry'])
+            except Exception as e:
+                fail(item, e)
+                return
+            if job:
+                # The worker moves on to the next item while ffmpeg converts this one
+                item['state'] = 'processing'
+                jobs.append((item, job))
+                job.add_done_callback(lambda f: processed(item, f))
+            else:
+                item['state'] = 'done'
+            self.progress = self._playlist_progress()
+
+        def processed(item, job):
+            with settle_lock: # from the job's callback, or after the wait if that came first
+                if item['state'] == 'processing':
+                    settle(item, job)
+
+        def settle(item, job):
+            if job.cancelled():
+                fail(item, Exception("Cancelled"))
+            elif job.exception():
+                fail(item, job.exception())
+            else:
+                item['filename'] = job.result()
+                item['state'] = 'done'
+                self.progress = self._playlist_progress()
+
+        def fail(item, e):
+            item['state'] = 'failed'
+            if item['filename']:
+                self._remove_partial(item['filename'])
+            if not self._cancel_requested:
+                print(f"Playlist item {item['url']} failed: {e}")
+                errors.append(str(e))
+            self.progress = self._playlist_progress()
+
+        jobs = []
+        settle_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=max(1, self.playlist_workers)) as pool:
+            list(pool.map(fetch, entries))
+        if jobs:
+            bandwidth_limiter.unregister(self.throttle)
+            self.processing = True
+            wait([job for _, job in jobs])
+            for item, job in jobs:
+                processed(item, job)
+
+        if self._cancel_requested:
+            raise Exception("Download cancelled by user")
+        done, failed, total = self.playlist_counts()
+        if not done:
+            raise Exception(f"All {total} playlist items failed: {errors[0]}")
+        notes = []
+        if failed:
+            notes.append(f"{done} of {total}, {failed} failed")
+        if self.skipped:
+            notes.append(f"{self.skipped} already downloaded")
+        return f"{self.playlist_title} ({', '.join(notes)})" if notes else self.playlist_title
+
+    def _skip_archived(self, entries):
+        """Drop the entries already in the archive: one indexed lookup per extractor, nothing fetched."""
+        known = {}
+        for ie_key in {entry['ie_key'] for entry in entries if entry['ie_key'] and entry['id']}:
+            ids = [entry['id'] for entry in entries if entry['ie_key'] == ie_key and entry['id']]
+            known[ie_key] = self.archive.known(ie_key, ids, self.format_type)
+        new = [entry for entry in entries if str(entry['id']) not in known.get(entry['ie_key'], ())]
+        self.skipped = len(entries) - len(new)
+        if self.skipped:
+            print(f"Skipping {self.skipped} playlist items already in the archive")
+        return new
+
+    def playlist_counts(self):
+        """(done, failed, total) items of the playlist being downloaded, None for a single video."""
+        if not self.playlist_items:
+            return None
+        states = [item['state'] for item in self.playlist_items]
+        return states.count('done'), states.count('failed'), len(states)
+
+    def _playlist_progress(self):
+        items = self.playlist_items
+        finished = sum(1 for item in items if item['state'] in ('done', 'failed', 'processing'))
+        progress = (finished + sum(item['progress'] for item in items if item['state'] == 'downloading')) / len(items)
+        speed = sum(item['speed'] for item in items if item['state'] == 'downloading')
+        elapsed = time.monotonic() - self._playlist_started
+        eta = f"{int(elapsed * (1 - progress) / progress)}s" if progress > 0 else 'N/A'
+        return (progress, f"{speed / 1024 / 1024:.2f} MiB/s", eta)
+
+    def _run_ydl(self, url, ydl_opts, progress_hook, entry=None):
+        # Each pause ends the yt-dlp run; the next one continues the .part files where they stopped
+        while True:
+            try:
+                with ydl_pool.get(ydl_opts, progress_hook) as ydl:
+                    return self._extract_and_download(ydl, url, ydl_opts, entry)
+            except Exception as e:
+                if "Download paused" not in str(e):
+                    raise
+            while not self._running.wait(0.25):
+                if self._cancel_requested:
+                    raise Exception("Download cancelled by user")
+
+    def _extract_and_download(self, ydl, url, ydl_opts, entry=None):
+        # Raw extractor output, before format selection, so any format can be picked from it later
+        key = f"{url}|{ydl_opts.get('noplaylist')}"
+        info = self.metadata_cache.get(key) if self.metadata_cache else None
+        if info is not None:
+            try:
+                return ydl.process_ie_result(info, download=True)
+            except Exception as e:
+                if "Download paused" in str(e) or self._cancel_requested:
+                    raise
+                # Most likely its signed stream URLs stopped working: extract again
+                print(f"Cached metadata for {url} failed ({e}), extracting again")
+                self.metadata_cache.invalidate(key)
+
+        if entry and entry.get('_type', 'video') == 'video':
+            info = copy.deepcopy(entry) # extracted already; processing changes it in place
+        elif entry:
+            info = self._resolve_entry(ydl, url, entry)
+        else:
+            info = ydl.extract_info(url, download=False, process=False)
+        if self.metadata_cache and info.get('_type', 'video') == 'video':
+            # Playlists hold lazy entry lists; their videos get cached one by one instead
+            info = {k: v for k, v in ydl.sanitize_info(info).items() if not k.startswith('__')}
+            self.metadata_cache.put(key, info)
+        return ydl.process_ie_result(info, download=True)
+
+    def _resolve_entry(self, ydl, url, entry):
+        """Extract a flat playlist entry through its own extractor, keeping what the playlist added."""
+        info = ydl.extract_info(url, download=False, ie_key=entry.get('ie_key'), process=False)
+        if entry.get('_type') == 'url_transparent':
+            # The playlist's fields win, as in yt-dlp's own handling of url_transparent
+            exempt = ('_type', 'url', 'ie_key', 'id', 'extractor', 'extractor_key')
+            info = dict(info, **{k: v for k, v in entry.items() if v is not None and k not in exempt})
+        return info
+
+    def _downloaded_file(self, info):
+        downloads = info.get('requested_downloads') or []
+        if len(downloads) != 1:
+            return None
+        return downloads[0].get('filepath')
+
+    def _admit_to_cache(self, key, path, info):
+        title = info.get('title', 'Unknown Title')
+        try:
+            self.cache.admit(key, path, title=title, extractor=info.get('extractor_key') or info.get('extractor'),
+                             video_id=info.get('id'))
+        except Exception as e:
+            print(f"Could not add {title} to the cache: {e}")
+
     def _cleanup(self):
+        for item in self.playlist_items or []:
+            if item['state'] != 'done' and item['filename']:
+                self._remove_partial(item['filename'])
+        if self.current_filename:
+            self._remove_partial(self.current_filename)
+
+    def _remove_partial(self, filename):
         try:
-            if self.current_filename and os.path.exists(self.current_filename):
-                os.remove(self.current_filename)
+            if os.path.exists(filename):
+                os.remove(filename)
             
             # Also check for .part
-            if self.current_filename:
-                part_file = self.current_filename + ".part"
-                if os.path.exists(part_file):
-                     os.remove(part_file)
+            part_file = filename + ".part"
+            if os.path.exists(part_file):
+                 os.remove(part_file)
         except Exception as e:
             print(f"Cleanup error: {e}")
@@ -1,70 +1,266 @@
-import requests
 import threading
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor
+import random
+from concurrent.futures import ThreadPoolExecutor, wait
+from manifest import DownloadManifest
+from network import get_session, is_transient_error, supports_ranges, known_range_support, set_range_support, parse_content_range, TIMEOUT
+from ratelimit import bandwidth_limiter
+from progress import SpeedMeter, format_speed, format_eta
+from checksum import StreamingHasher, ChecksumMismatch, parse_checksum
+from mirrors import Mirror, MirrorSet
+from filewriter import FileWriter, preallocate
+from cache import file_key
+
+MANIFEST_SAVE_INTERVAL = 2 # seconds
+MIN_SEGMENT_SIZE = 1024 * 1024 # don't split work units below this
+DEFAULT_BLOCK_SIZE = 1024 * 1024 # bytes read from the socket per write
+WRITE_ALIGNMENT = 64 * 1024 # segment boundaries fall on multiples of this
+WRITE_BEHIND_BLOCKS = 8 # blocks that may wait for the disk before the sockets stall
+
+# Retries
+DEFAULT_MAX_RETRIES = 20 # per download, shared by all segments
+RETRY_BASE_DELAY = 1 # seconds, doubled on every failed attempt in a row
+RETRY_MAX_DELAY = 30
+
+# Connection auto-tuning
+MAX_CONNECTIONS = 16
+INITIAL_CONNECTIONS = 2
+SINGLE_STREAM_THRESHOLD = 4 * 1024 * 1024 # smaller files aren't worth splitting
+TUNE_INTERVAL = 1.5 # seconds between throughput samples
+TUNE_MIN_GAIN = 0.1 # a new connection must add at least 10% throughput
+
+class RemoteFileChanged(Exception):
+    pass
+
+class RangesNotSupported(Exception):
+    pass
+
+class ServerBusy(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ConnectionTuner:
+    """Adds connections one at a time while aggregate throughput keeps improving."""
+    def __init__(self, max_connections, downloaded):
+        self.cap = max_connections
+        self.settled = False
+        self.best = 0
+        self.last_bytes = downloaded
+        self.last_time = time.time()
+
+    def restart(self, downloaded):
+        self.last_bytes = downloaded
+        self.last_time = time.time()
+
+    def should_grow(self, downloaded, connections):
+        now = time.time()
+        throughput = (downloaded - self.last_bytes) / (now - self.last_time)
+        self.last_bytes, self.last_time = downloaded, now
+
+        if self.settled or connections >= self.cap:
+            return False
+        if throughput > self.best * (1 + TUNE_MIN_GAIN):
+            self.best = throughput
+            return True
+        self.settle(connections, "throughput flattened")
+        return False
+
+    def back_off(self, connections):
+        self.cap = max(1, connections - 1)
+        self.settle(self.cap, "server is throttling")
+
+    def settle(self, connections, reason):
+        if not self.settled:
+            print(f"Settled on {connections} connections ({reason})")
+        self.settled = True
+
+class Segment:
+    def __init__(self, start, end, pos=None):
+        self.start = start
+        self.end = end
+        self.pos = start if pos is None else pos # next byte to fetch
+        self.written = self.pos # everything before this is on disk
+        self.active = False # a worker is currently fetching it
+        self.lock = threading.Lock() # guards end/pos against a concurrent steal
+
+    @property
+    def remaining(self):
+        return self.end - self.pos + 1
 
 class SegmentedFileDownloader:
-    def __init__(self, num_threads=8):
+    def __init__(self, num_threads=None, speed_limit=0, block_size=DEFAULT_BLOCK_SIZE, max_retries=DEFAULT_MAX_RETRIES, fsync_interval=0, validators=None, cache=None):
+        # Leave num_threads as None to let the downloader pick the connection count
         self.num_threads = num_threads
+        self.block_size = block_size
+        self.fsync_interval = fsync_interval # seconds between fsyncs of the target, 0 = never
+        self.writer = None
+        self.validators = validators # ValidatorStore, enables conditional re-downloads
+        self.cache = cache # DownloadCache, None = off
+        self.max_retries = max_retries
+        self.retries_left = max_retries
+        self.speed_limit = speed_limit # bytes/s, 0 = only the global limit applies
+        self.throttle = None
+        self.max_connections = num_threads or MAX_CONNECTIONS
+        self.connections = 0
+        self.tuner = None
         self._cancel_requested = False
+        self._aborted = False # a worker failed, the rest should stop
+        self._running = threading.Event() # cleared while paused
+        self._running.set()
         self.download_thread = None
         self.current_filename = None
-        self.temp_dir = None
+        self.manifest = None
+        self.segments = []
+        self.lock = threading.Lock()
+        self.session = None
+        self.total_size = 0
+        self.downloaded_bytes = 0 # single-stream mode only, segments track their own
+        self.speed_meter = SpeedMeter()
+        self.hasher = None
+        self.mirrors = None
+        self.primed = None # the open probe response, handed to whoever fetches from byte 0
 
     def cancel(self):
         self._cancel_requested = True
 
-    def download(self, url, output_path, progress_callback=None, completion_callback=None, error_callback=None, title_callback=None):
+    def pause(self):
+        """Park the workers and close their connections; resume() continues from the same bytes."""
+        self._running.clear()
+        self._discard_primed()
+        if self.throttle:
+            bandwidth_limiter.set_paused(self.throttle, True)
+
+    def resume(self):
+        if self.throttle:
+            bandwidth_limiter.set_paused(self.throttle, False)
+        self._running.set()
+
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def _wait_while_paused(self):
+        while not self._running.wait(0.25):
+            if self._is_cancelled():
+                return
+
+    def _is_cancelled(self):
+        return self._cancel_requested or self._aborted
+
+    def get_progress(self):
+        """Snapshot for the UI tick: (progress, speed, eta) or None before the transfer starts."""
+        if not self.total_size and not self.downloaded_bytes:
+            return None
+        downloaded = self._downloaded()
+        speed = self.speed_meter.update(downloaded)
+        speed_str = format_speed(speed)
+        if self.segments and self.connections:
+            speed_str += f" ({self.connections} conn)"
+        progress = downloaded / self.total_size if self.total_size > 0 else 0
+        eta = (self.total_size - downloaded) / speed if speed > 0 else 0
+        return progress, speed_str, format_eta(eta)
+
+    def _downloaded(self):
+        if not self.segments:
+            return self.downloaded_bytes
+        with self.lock:
+            return self.total_size - sum(seg.remaining for seg in self.segments)
+
+    def download(self, url, output_path, completion_callback=None, error_callback=None, title_callback=None, checksum=None, mirrors=None):
+        """
+        checksum: optional 'sha256:<hex>' (or bare hex digest) verified while the data streams in.
+        mirrors: optional extra URLs serving the same file; segments are spread across all of them.
+        """
         self._cancel_requested = False
+        self._aborted = False
+        self.segments = []
+        self.total_size = 0
+        self.downloaded_bytes = 0
+        self.retries_left = self.max_retries
+        self.speed_meter.reset()
         
         def run():
+            self.throttle = bandwidth_limiter.register(self.speed_limit)
+            if self.is_paused():
+                bandwidth_limiter.set_paused(self.throttle, True)
             try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept-Encoding': 'identity'
-                }
+                expected = parse_checksum(checksum)
+                if self.cache and expected and expected[0] == 'sha256':
+                    # Known content needs no network at all
+                    hit = self.cache.lookup_hash(expected[1])
+                    if hit:
+                        self._serve_from_cache(hit, os.path.join(output_path, hit['name']), title_callback)
+                        if completion_callback:
+                            completion_callback(hit['name'])
+                        return
 
-                # 1. Get File Info & Resolve Redirects
-                try:
-                    head = requests.head(url, allow_redirects=True, timeout=10, headers=headers)
-                    if head.status_code >= 400:
-                        raise Exception(f"HTTP Error: {head.status_code}")
-                    
-                    # Use the final URL after redirects for actual downloading
-                    resolved_url = head.url 
-                    total_size = int(head.headers.get('content-length', 0))
-                    filename = self._get_filename(resolved_url, head)
+                self.session = get_session(url, self.max_connections)
 
-                except Exception as e:
-                    # Fallback to GET stream if HEAD fails (some servers deny HEAD)
-                    # or if HEAD failed for other reasons
-                    print(f"HEAD request failed: {e}. Retrying with GET...")
-                    r = requests.get(url, stream=True, timeout=10, allow_redirects=True, headers=headers)
-                    r.raise_for_status()
-                    
-                    resolved_url = r.url
-                    total_size = int(r.headers.get('content-length', 0))
-                    filename = self._get_filename(resolved_url, r)
-                    r.close()
+                # A copy from an earlier download lets the server answer 304 instead
+                previous = self.validators.lookup(url, output_path) if self.validators else None
+                conditional = self.validators.conditional_headers(previous) if previous else {}
+
+                # 1. Get File Info & Resolve Redirects
+                resolved_url, total_size, filename, validators, status, ranged = self._probe(url, conditional)
+                if previous and (status == 304 or self.validators.matches(previous, total_size, validators)):
+                    if self._reuse_previous(previous, expected, title_callback):
+                        if completion_callback:
+                            completion_callback(os.path.basename(previous['path']))
+                        return
+                    if status == 304:
+                        resolved_url, total_size, filename, validators, status, ranged = self._probe(url, {})
 
                 full_path = os.path.join(output_path, filename)
+                cache_key = file_key(url, validators, total_size) if self.cache else None
+                hit = self.cache.lookup(cache_key) if cache_key else None
+                if hit and self._cached_matches(hit, expected):
+                    self._serve_from_cache(hit, full_path, title_callback)
+                    if self.validators:
+                        self.validators.record(url, full_path, validators, hit['size'])
+                    if completion_callback:
+                        completion_callback(filename)
+                    return
+
+                # Redirects may land on a different host (e.g. a CDN), pool for that one
+                self.session = get_session(resolved_url, self.max_connections)
+
                 self.current_filename = full_path
                 
                 if title_callback:
                     title_callback(filename)
+                self.total_size = total_size
+                self.hasher = StreamingHasher(expected, full_path) if expected else None
                 
-                # Check if resume capability is possible (server supports ranges)
-                ranges_supported = head.headers.get('Accept-Ranges') == 'bytes' or total_size > 0
-                
-                if not ranges_supported or total_size == 0:
-                    self._download_single_thread(resolved_url, full_path, total_size, progress_callback)
+                # Only split the file if the server provably honours Range requests
+                # (and hasn't been caught ignoring them for other files)
+                if total_size > 0 and ranged and known_range_support(resolved_url) is not False:
+                    try:
+                        self._prepare_manifest(url, full_path, total_size, validators)
+                        primary = Mirror(resolved_url, self.session, self.if_range)
+                        self.mirrors = MirrorSet([primary] + self._probe_mirrors(mirrors or [], total_size, validators))
+                        self._download_segmented(full_path)
+                    except RangesNotSupported as e:
+                        print(f"{e}, falling back to a single stream")
+                        set_range_support(resolved_url, False)
+                        self._discard_primed()
+                        self._fall_back_to_single_stream()
+                        self._download_single_thread(resolved_url, full_path)
                 else:
-                    self._download_segmented(resolved_url, full_path, total_size, progress_callback)
+                    self._download_single_thread(resolved_url, full_path)
                     
                 if not self._cancel_requested:
+                    if self.hasher:
+                        self.hasher.catch_up(self.total_size or self.downloaded_bytes)
+                        self.hasher.verify()
+                    if self.manifest:
+                        self.manifest.remove()
+                    if self.validators:
+                        self.validators.record(url, full_path, validators, os.path.getsize(full_path))
                     if completion_callback:
                         completion_callback(filename)
+                    if self.cache:
+                        self._admit_to_cache(cache_key, full_path, expected)
                 else:
                     raise Exception("Download cancelled by user")
 
@@ -75,11 +271,114 @@ class SegmentedFileDownloader:
                     self._cleanup()
                 else:
                     if error_callback: error_callback(str(e))
-                    self._cleanup()
+                    if self.manifest and not isinstance(e, (RemoteFileChanged, ChecksumMismatch)):
+                        # Keep the partial file so the next attempt can resume it
+                        self._save_manifest()
+                    else:
+                        self._cleanup()
+            finally:
+                self._discard_primed()
+                bandwidth_limiter.unregister(self.throttle)
 
         self.download_thread = threading.Thread(target=run)
         self.download_thread.start()
 
+    def _serve_from_cache(self, hit, full_path, title_callback):
+        self._discard_primed() # don't hold the connection open while copying
+        self.current_filename = full_path
+        if title_callback:
+            title_callback(os.path.basename(full_path))
+        self.cache.place(hit, full_path)
+        self.total_size = self.downloaded_bytes = hit['size']
+
+    def _cached_matches(self, hit, expected):
+        """A cache hit only counts if it also passes the checksum the user asked for."""
+        if not expected:
+            return True
+        algorithm, digest = expected
+        if algorithm == 'sha256':
+            actual = os.path.basename(hit['path']) # objects are stored under their SHA-256
+        else:
+            hasher = StreamingHasher(expected, hit['path'])
+            hasher.catch_up(hit['size'])
+            actual = hasher.hash.hexdigest()
+        if actual != digest:
+            print(f"Cached copy doesn't match the expected {algorithm} checksum, downloading again")
+            return False
+        return True
+
+    def _admit_to_cache(self, key, path, expected):
+        # A verified SHA-256 saves hashing the file again
+        digest = expected[1] if expected and expected[0] == 'sha256' else None
+        if not key and not digest:
+            return # nothing could ever look it up again
+        try:
+            self.cache.admit(key, path, digest=digest)
+        except Exception as e:
+            print(f"Could not add {os.path.basename(path)} to the cache: {e}")
+
+    def _probe(self, url, headers):
+        """
+        Open the download with a single `Range: bytes=0-` GET instead of a HEAD round trip.
+        Returns (resolved url, size, filename, response headers, status, ranged). Unless it
+        was a 304, the response is kept open in self.primed so its body isn't requested twice.
+        """
+        r = self.session.get(url, stream=True, headers={**headers, 'Range': 'bytes=0-'}, timeout=TIMEOUT, allow_redirects=True)
+        if r.status_code == 416:
+            r.close() # empty file, nothing to range over
+            r = self.session.get(url, stream=True, headers=headers, timeout=TIMEOUT, allow_redirects=True)
+        if r.status_code >= 400:
+            r.close()
+            r.raise_for_status()
+
+        content_range = parse_content_range(r.headers.get('Content-Range'))
+        ranged = r.status_code == 206 and content_range is not None and content_range[0] == 0 and content_range[2] is not None
+        if ranged:
+            total_size = content_range[2]
+        elif r.status_code == 206:
+            total_size = 0 # a partial answer of unknown length
+        else:
+            total_size = int(r.headers.get('content-length', 0))
+
+        if r.status_code == 304 or (content_range is not None and content_range[0] != 0):
+            r.close()
+        else:
+            with self.lock:
+                self.primed = r
+        return r.url, total_size, self._get_filename(r.url, r), r.headers, r.status_code, ranged
+
+    def _take_primed(self, offset):
+        """The probe response if it can serve bytes from offset, else None. Only one caller gets it."""
+        with self.lock:
+            if self.primed is None or offset != 0:
+                return None
+            r, self.primed = self.primed, None
+            return r
+
+    def _discard_primed(self):
+        with self.lock:
+            r, self.primed = self.primed, None
+        if r is not None:
+            r.close()
+
+    def _reuse_previous(self, previous, expected, title_callback):
+        """Finish without a transfer if the copy from last time is still current."""
+        self._discard_primed()
+        if expected:
+            # A checksum was asked for, so the old copy has to pass it too
+            hasher = StreamingHasher(expected, previous['path'])
+            hasher.catch_up(previous['size'])
+            try:
+                hasher.verify()
+            except ChecksumMismatch as e:
+                print(f"{e}, downloading again")
+                return False
+        print(f"{os.path.basename(previous['path'])} is unchanged, skipping the download")
+        if title_callback:
+            title_callback(os.path.basename(previous['path']))
+        self.total_size = self.downloaded_bytes = previous['size']
+        return True
+
     def _get_filename(self, url, response):
         # Try content-disposition
         if "Content-Disposition" in response.headers:
@@ -90,97 +389,379 @@ class SegmentedFileDownloader:
         # Fallback to URL
         return os.path.basename(url.split("?")[0])
 
-    def _download_single_thread(self, url, filepath, total_size, progress_callback):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept-Encoding': 'identity'
-        }
-        with requests.get(url, stream=True, headers=headers) as r:
-            r.raise_for_status()
-            downloaded = 0
-            start_time = time.time()
-            with open(filepath, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if self._cancel_requested:
-                        return
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if progress_callback:
-                            self._report_progress(downloaded, total_size, start_time, progress_callback)
-
-    def _download_segmented(self, url, filepath, total_size, progress_callback):
-        chunk_size = total_size // self.num_threads
-        futures = []
+    def _fall_back_to_single_stream(self):
+        self._aborted = False
+        self.manifest.remove()
+        self.manifest = None
+        self.segments = []
         self.downloaded_bytes = 0
-        self.start_time = time.time()
-        self.lock = threading.Lock()
-        
-        # Temp directory for parts
-        self.temp_dir = filepath + "_parts"
-        if not os.path.exists(self.temp_dir):
-            os.makedirs(self.temp_dir)
+        if self.hasher:
+            self.hasher.reset()
+
+    def _download_single_thread(self, url, filepath):
+        preallocate(filepath, self.total_size)
+        attempt = 0
+        with FileWriter(filepath, self.block_size, WRITE_BEHIND_BLOCKS + 1, self.fsync_interval) as writer:
+            self.writer = writer
+            while not self._cancel_requested:
+                self._wait_while_paused()
+                if self._cancel_requested:
+                    break
+                offset = self.downloaded_bytes
+                try:
+                    # After a drop, ask for the rest only
+                    headers = {'Range': f'bytes={offset}-'} if offset else {}
+                    r = self._take_primed(offset) or self.session.get(url, stream=True, headers=headers, timeout=TIMEOUT)
+                    with r:
+                        r.raise_for_status()
+                        if offset and r.status_code != 206:
+                            print("Server can't resume this download, starting over")
+                            writer.flush()
+                            os.truncate(filepath, self.total_size)
+                            self.downloaded_bytes = 0
+                            if self.hasher:
+                                self.hasher.reset()
+
+                        # Pausing drops the connection; the next pass asks for the rest with Range
+                        while not self._cancel_requested and not self.is_paused():
+                            buffer = writer.acquire(self._is_cancelled)
+                            if buffer is None:
+                                return
+                            try:
+                                n = self._read_block(r.raw, buffer)
+                            except BaseException:
+                                writer.release(buffer)
+                                raise
+                            if not n:
+                                writer.release(buffer)
+                                if self.total_size and self.downloaded_bytes < self.total_size:
+                                    raise ConnectionError(f"Connection closed at byte {self.downloaded_bytes}")
+                                return
+                            writer.submit(self.downloaded_bytes, buffer, n, self._on_written(self.downloaded_bytes))
+                            self.downloaded_bytes += n
+                            self.throttle.consume(n, self._is_cancelled)
+                except Exception as e:
+                    if not is_transient_error(e):
+                        raise
+                    if self.downloaded_bytes > offset:
+                        attempt = 0 # it was making progress, start the backoff over
+                    self._wait_before_retry(attempt, e)
+                    attempt += 1
+
+    def _on_written(self, offset, segment=None):
+        """Callback for the writer thread once a block is on disk."""
+        def done(view):
+            if segment:
+                segment.written = offset + len(view)
+            if self.hasher:
+                self.hasher.feed(offset, view)
+        return done
+
+    def _wait_before_retry(self, attempt, error, min_delay=0):
+        """Sleep with jittered exponential backoff, or re-raise once the retry budget is spent."""
+        with self.lock:
+            if self.retries_left <= 0:
+                raise error
+            self.retries_left -= 1
+        delay = max(min_delay, random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+        print(f"{error} - retrying in {delay:.1f}s ({self.retries_left} retries left)")
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline and not self._is_cancelled():
+            time.sleep(min(0.25, deadline - time.monotonic()))
+
+    def _prepare_manifest(self, url, filepath, total_size, headers):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+
+        manifest = DownloadManifest.load(filepath)
+        if manifest and manifest.matches(url, total_size, etag, last_modified):
+            print(f"Resuming {os.path.basename(filepath)} from manifest")
+            self.segments = [Segment(*seg) for seg in manifest.segments]
+        else:
+            if manifest:
+                manifest.remove()
+            manifest = DownloadManifest(filepath)
+            manifest.url = url
+            manifest.etag = etag
+            manifest.last_modified = last_modified
+            manifest.total_size = total_size
 
-        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
-            for i in range(self.num_threads):
+            # One initial work unit per worker; idle workers split the rest up later
+            if self._single_stream(total_size):
+                count = 1
+            else:
+                count = max(1, min(self.max_connections, total_size // MIN_SEGMENT_SIZE))
+            chunk_size = total_size // count
+            chunk_size = max(WRITE_ALIGNMENT, chunk_size - chunk_size % WRITE_ALIGNMENT)
+            self.segments = []
+            for i in range(count):
                 start = i * chunk_size
-                end = start + chunk_size - 1 if i < self.num_threads - 1 else total_size - 1
-                part_file = os.path.join(self.temp_dir, f"part_{i}")
-                futures.append(executor.submit(self._download_chunk, url, start, end, part_file, total_size, progress_callback))
-
-            # Wait for all
-            for f in futures:
-                if f.exception() or self._cancel_requested:
-                    raise f.exception() or Exception("Cancelled")
-
-        # Merge
-        if not self._cancel_requested:
-            with open(filepath, 'wb') as outfile:
-                for i in range(self.num_threads):
-                    part_file = os.path.join(self.temp_dir, f"part_{i}")
-                    with open(part_file, 'rb') as infile:
-                        outfile.write(infile.read())
-            
-            # Cleanup parts
-            import shutil
-            shutil.rmtree(self.temp_dir)
-
-    def _download_chunk(self, url, start, end, part_path, total_size, progress_callback):
-        headers = {
-            'Range': f'bytes={start}-{end}',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-             'Accept-Encoding': 'identity'
-        }
-        # Check if part exists to resume (simple) - for now overwrite
-        with requests.get(url, headers=headers, stream=True) as r:
-            with open(part_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if self._cancel_requested:
+                end = start + chunk_size - 1 if i < count - 1 else total_size - 1
+                self.segments.append(Segment(start, end))
+
+            # Reserve the whole file so every block goes straight to its own offset
+            preallocate(filepath, total_size)
+
+        if not any(seg.pos == 0 and seg.remaining > 0 for seg in self.segments):
+            self._discard_primed() # resuming past byte 0: nobody will read the probe's body
+        self.manifest = manifest
+        self.if_range = self._if_range_validator(headers)
+        self._save_manifest()
+
+    def _if_range_validator(self, headers):
+        # If-Range needs a strong validator; weak ETags are only usable for caching
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return headers.get('Last-Modified')
+
+    def _probe_mirrors(self, urls, total_size, headers):
+        etag = headers.get('ETag')
+        mirrors = []
+        for url in urls:
+            try:
+                session = get_session(url, self.max_connections)
+                head = session.head(url, allow_redirects=True, timeout=10)
+                head.raise_for_status()
+                size = int(head.headers.get('content-length', 0))
+                if size != total_size:
+                    raise Exception(f"size {size} != {total_size}")
+                mirror_etag = head.headers.get('ETag')
+                if etag and mirror_etag and mirror_etag != etag:
+                    raise Exception(f"ETag {mirror_etag} != {etag}")
+                if not supports_ranges(session, head.url, head.headers):
+                    raise Exception("no Range support")
+                mirrors.append(Mirror(head.url, get_session(head.url, self.max_connections), self._if_range_validator(head.headers)))
+            except Exception as e:
+                print(f"Skipping mirror {url}: {e}")
+        return mirrors
+
+    def _save_manifest(self):
+        with self.lock:
+            # Only what has reached the disk counts; queued blocks are fetched again on resume
+            self.manifest.segments = [[seg.start, seg.end, seg.written] for seg in self.segments if seg.written <= seg.end]
+        self.manifest.save()
+
+    def _next_segment(self):
+        with self.lock:
+            # Unstarted (or resumed) work first
+            for seg in self.segments:
+                if not seg.active and seg.remaining > 0:
+                    seg.active = True
+                    return seg
+
+            # Otherwise steal the back half of the segment with the most left to fetch
+            busy = [seg for seg in self.segments if seg.active]
+            if not busy:
+                return None
+            victim = max(busy, key=lambda seg: seg.remaining)
+            with victim.lock:
+                if victim.remaining < 2 * MIN_SEGMENT_SIZE:
+                    return None
+                mid = victim.pos + victim.remaining // 2
+                mid -= mid % WRITE_ALIGNMENT
+                stolen = Segment(mid, victim.end)
+                victim.end = mid - 1 # the victim stops reading once it gets here
+            stolen.active = True
+            self.segments.append(stolen)
+            return stolen
+
+    def _single_stream(self, total_size):
+        return self.num_threads is None and total_size < SINGLE_STREAM_THRESHOLD
+
+    def _has_work(self):
+        with self.lock:
+            return any((not seg.active and seg.remaining > 0) or seg.remaining >= 2 * MIN_SEGMENT_SIZE
+                       for seg in self.segments)
+
+    def _worker(self, filepath):
+        counted = True
+        try:
+            while not self._is_cancelled():
+                segment = self._next_segment()
+                if segment is None:
+                    return
+                try:
+                    if not self._fetch_segment(segment, filepath):
+                        counted = False # it already gave up its connection
                         return
-                    if chunk:
-                        f.write(chunk)
-                        with self.lock:
-                            self.downloaded_bytes += len(chunk)
-                            if progress_callback:
-                                self._report_progress(self.downloaded_bytes, total_size, self.start_time, progress_callback)
-
-    def _report_progress(self, downloaded, total, start_time, callback):
-        elapsed = time.time() - start_time
-        speed = downloaded / elapsed if elapsed > 0 else 0
-        speed_str = f"{speed / 1024 / 1024:.2f} MiB/s"
-        
-        percent = downloaded / total if total > 0 else 0
-        eta = (total - downloaded) / speed if speed > 0 else 0
-        eta_str = f"{int(eta)}s"
-        
-        callback(percent, speed_str, eta_str)
+                finally:
+                    with self.lock:
+                        segment.active = False
+        finally:
+            if counted:
+                with self.lock:
+                    self.connections -= 1
+
+    def _fetch_segment(self, segment, filepath):
+        """
+        Fetch a work unit, retrying from wherever it got to on transient errors.
+        Returns False when this connection should be closed for good.
+        """
+        attempt = 0
+        while segment.remaining > 0 and not self._is_cancelled():
+            self._wait_while_paused()
+            if self._is_cancelled():
+                break
+            # The probe's response is already streaming from byte 0 on the primary
+            primed = self._take_primed(segment.pos)
+            mirror = self.mirrors.mirrors[0] if primed else self.mirrors.pick()
+            pos = segment.pos
+            try:
+                self._download_chunk(mirror, segment, filepath, primed)
+            except ServerBusy as e:
+                with self.lock:
+                    if self.connections > 1:
+                        # Too many connections for this server: drop this one for good.
+                        # Counted off right here, so workers hit at once can't all leave.
+                        if self.tuner:
+                            self.tuner.back_off(self.connections)
+                        self.connections -= 1
+                        return False
+                self._wait_before_retry(attempt, e, e.retry_after or 0)
+                attempt += 1
+            except Exception as e:
+                # Another mirror picks the segment up where this one left it
+                if self.mirrors.fail(mirror):
+                    print(f"Mirror {mirror.url} failed: {e}")
+                    continue
+                if not is_transient_error(e):
+                    raise
+                if segment.pos > pos:
+                    attempt = 0 # it was making progress, start the backoff over
+                self._wait_before_retry(attempt, e)
+                attempt += 1
+        return True
+
+    def _spawn_worker(self, executor, filepath):
+        with self.lock:
+            self.connections += 1
+        return executor.submit(self._worker, filepath)
+
+    def _download_segmented(self, filepath):
+        total_size = self.total_size
+        self.connections = 0
+        self._aborted = False
+
+        if self._single_stream(total_size):
+            initial, self.tuner = 1, None
+        elif self.num_threads is None:
+            initial, self.tuner = INITIAL_CONNECTIONS, ConnectionTuner(self.max_connections, self._downloaded())
+        else:
+            initial, self.tuner = self.num_threads, None
+
+        # Every connection fills one buffer while up to WRITE_BEHIND_BLOCKS wait for the disk
+        pool_size = self.max_connections + WRITE_BEHIND_BLOCKS
+        with FileWriter(filepath, self.block_size, pool_size, self.fsync_interval) as self.writer, \
+                ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            pending = {self._spawn_worker(executor, filepath)
+                       for _ in range(initial)}
+
+            # Wait for all, checkpointing progress so a crash loses at most a few seconds
+            last_save = time.time()
+            respawned_at = -1
+            while pending:
+                done, pending = wait(pending, timeout=TUNE_INTERVAL)
+                for f in done:
+                    if f.exception():
+                        self._aborted = True # Stop the other workers
+                        raise f.exception()
+                if self._cancel_requested:
+                    raise Exception("Cancelled")
+
+                if self.tuner and self.is_paused():
+                    self.tuner.restart(self._downloaded()) # a paused interval says nothing about throughput
+                elif self.tuner and pending and self.tuner.should_grow(self._downloaded(), self.connections) and self._has_work():
+                    pending.add(self._spawn_worker(executor, filepath))
+
+                # The last workers can leave together (one out of work, one dropped on a 429).
+                # Bytes still missing: carry on with a fresh connection, as long as the last one got somewhere.
+                if not pending and self._has_work() and self._downloaded() > respawned_at:
+                    respawned_at = self._downloaded()
+                    pending.add(self._spawn_worker(executor, filepath))
+
+                if time.time() - last_save >= MANIFEST_SAVE_INTERVAL:
+                    self._save_manifest()
+                    last_save = time.time()
+
+                if self.hasher:
+                    self.hasher.catch_up(self._completed_prefix())
+
+        # Every worker is gone; make sure that's because the work ran out
+        missing = sum(max(0, seg.end - seg.written + 1) for seg in self.segments)
+        if missing and not self._cancel_requested:
+            raise Exception(f"Download stopped with {missing} bytes still missing")
+
+    def _completed_prefix(self):
+        # Segments partition the file, so the first unfinished one ends the contiguous prefix
+        with self.lock:
+            for seg in sorted(self.segments, key=lambda seg: seg.start):
+                if seg.written <= seg.end:
+                    return seg.written
+        return self.total_size
+
+    def _download_chunk(self, mirror, segment, filepath, response=None):
+        if response is None:
+            headers = {'Range': f'bytes={segment.pos}-{segment.end}'}
+            if mirror.if_range:
+                headers['If-Range'] = mirror.if_range
+            response = mirror.session.get(mirror.url, headers=headers, stream=True, timeout=TIMEOUT)
+
+        with response as r:
+            if r.status_code in (429, 503):
+                retry_after = r.headers.get('Retry-After', '')
+                raise ServerBusy(f"HTTP Error: {r.status_code}", int(retry_after) if retry_after.isdigit() else None)
+            if mirror.if_range and r.status_code == 200 and mirror.if_range != self._if_range_validator(r.headers):
+                # If-Range failed: the file changed since the bytes we already have
+                raise RemoteFileChanged("Remote file changed since the download started")
+            r.raise_for_status()
+            # A 200 or a range starting elsewhere means the server ignored Range:
+            # writing that body here would corrupt the file
+            content_range = parse_content_range(r.headers.get('Content-Range'))
+            if r.status_code != 206 or content_range is None or content_range[0] != segment.pos:
+                raise RangesNotSupported(f"{mirror.url} ignored the Range request")
+            if content_range[2] is not None and content_range[2] != self.total_size:
+                raise RemoteFileChanged("Remote file changed since the download started")
+            while not self._is_cancelled() and segment.remaining > 0 and mirror.active and not self.is_paused():
+                buffer = self.writer.acquire(self._is_cancelled)
+                if buffer is None:
+                    return
+                try:
+                    started = time.monotonic()
+                    n = self._read_block(r.raw, buffer[:min(self.block_size, segment.remaining)])
+                    if not n:
+                        raise ConnectionError(f"Connection closed at byte {segment.pos}")
+                except BaseException:
+                    self.writer.release(buffer)
+                    raise
+                self.mirrors.record(mirror, n, time.monotonic() - started)
+                with segment.lock:
+                    # Never write past our range; a thief may have shortened it
+                    n = min(n, segment.remaining)
+                    offset = segment.pos
+                    segment.pos += n
+                if n:
+                    # The writer thread puts it on disk; this connection goes straight back to reading
+                    self.writer.submit(offset, buffer, n, self._on_written(offset, segment))
+                else:
+                    self.writer.release(buffer)
+                self.throttle.consume(n, self._is_cancelled)
+
+    def _read_block(self, raw, buffer):
+        """Fill the reusable buffer from the socket; returns the byte count, 0 at EOF."""
+        filled = 0
+        while filled < len(buffer):
+            n = raw.readinto(buffer[filled:])
+            if not n:
+                break
+            filled += n
+        return filled
 
     def _cleanup(self):
         try:
             if self.current_filename and os.path.exists(self.current_filename):
                 os.remove(self.current_filename)
-            if self.temp_dir and os.path.exists(self.temp_dir):
-                import shutil
-                shutil.rmtree(self.temp_dir)
+            if self.manifest:
+                self.manifest.remove()
         except:
             pass
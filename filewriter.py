@@ -0,0 +1,163 @@
+import os
+import queue
+import threading
+import time
+
+def preallocate(filepath, size):
+    """Create the file at its final size, reserving the disk space up front where the OS allows."""
+    if os.path.exists(filepath):
+        # Unlink rather than truncate: the old file may be hardlinked from the download cache
+        os.remove(filepath)
+    with open(filepath, 'wb') as f:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass # e.g. not supported by this filesystem
+        f.truncate(size)
+
+class FileWriter:
+    """
+    Write-behind stage between the network workers and the disk.
+    Workers take a buffer from a bounded pool, fill it from the socket and queue it
+    with its file offset; one writer thread writes the queue out (contiguous blocks in
+    a single call where the OS supports it) and hands the buffers back. When the disk
+    falls behind, the pool runs dry and the workers wait instead of growing memory.
+    """
+    def __init__(self, filepath, block_size, pool_size, fsync_interval=0):
+        self.filepath = filepath
+        self.fsync_interval = fsync_interval # seconds, 0 = leave flushing to the OS
+        self.free = queue.Queue()
+        for _ in range(pool_size):
+            self.free.put(memoryview(bytearray(block_size)))
+        self.pending = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close() # still drain the queue so the manifest matches the disk
+        except Exception:
+            pass # the original error is the one worth reporting
+
+    def acquire(self, is_cancelled=None):
+        """Get an empty buffer, waiting for the writer if needed. None if cancelled."""
+        while True:
+            self._check()
+            try:
+                return self.free.get(timeout=0.25)
+            except queue.Empty:
+                if is_cancelled and is_cancelled():
+                    return None
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+    def submit(self, offset, buffer, length, on_written=None):
+        """Queue buffer[:length] for writing at offset. on_written(view) runs once it is on disk."""
+        self._check()
+        self.pending.put((offset, buffer, length, on_written))
+
+    def flush(self):
+        """Block until everything queued so far is on disk."""
+        self.pending.join()
+        self._check()
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self._check()
+
+    def _check(self):
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        last_sync = time.monotonic()
+        with open(self.filepath, 'r+b', buffering=0) as f:
+            while True:
+                batch = [self.pending.get()]
+                if batch[0] is None:
+                    self.pending.task_done()
+                    break
+                # Take whatever else is already waiting, so contiguous blocks go out together
+                while True:
+                    try:
+                        item = self.pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                    if item is None:
+                        break
+
+                for run in self._contiguous_runs([item for item in batch if item is not None]):
+                    if not self.error:
+                        try:
+                            self._write(f, run)
+                        except Exception as e:
+                            self.error = e
+                    for offset, buffer, length, on_written in run:
+                        if on_written and not self.error:
+                            on_written(buffer[:length])
+                        self.free.put(buffer)
+
+                if self.fsync_interval and time.monotonic() - last_sync >= self.fsync_interval:
+                    try:
+                        os.fsync(f.fileno())
+                    except OSError as e:
+                        self.error = self.error or e
+                    last_sync = time.monotonic()
+
+                for _ in batch:
+                    self.pending.task_done()
+                if batch[-1] is None:
+                    break
+            if self.fsync_interval and not self.error:
+                try:
+                    os.fsync(f.fileno())
+                except OSError as e:
+                    self.error = e
+
+    def _contiguous_runs(self, items):
+        run = []
+        for item in items:
+            if run and run[-1][0] + run[-1][2] != item[0]:
+                yield run
+                run = []
+            run.append(item)
+        if run:
+            yield run
+
+    def _write(self, f, run):
+        views = [buffer[:length] for _, buffer, length, _ in run]
+        offset = run[0][0]
+        if hasattr(os, 'pwritev'):
+            total = sum(len(v) for v in views)
+            written = os.pwritev(f.fileno(), views, offset)
+            if written == total:
+                return
+            # Short write (rare on regular files): finish the rest one block at a time
+            views = self._skip(views, written)
+            offset += written
+        f.seek(offset)
+        for view in views:
+            while len(view):
+                view = view[f.write(view):]
+
+    def _skip(self, views, count):
+        rest = []
+        for view in views:
+            if count >= len(view):
+                count -= len(view)
+                continue
+            rest.append(view[count:])
+            count = 0
+        return rest
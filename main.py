@@ -8,14 +8,24 @@ from PIL import Image
 from downloader import MediaDownloader
 from downloader_generic import SegmentedFileDownloader
 from history import HistoryManager
+from validators import ValidatorStore
+from cache import DownloadCache
+from metadata_cache import MetadataCache
+from archive import DownloadArchive
 from config import ConfigManager
 from utils import resource_path, detect_category
 from ui.dialogs import AddDownloadDialog, SettingsDialog
 from ui.widgets import DownloadItem, HistoryItem
 import queue
 from server import BackgroundServer
+from network import close_sessions
+from ratelimit import bandwidth_limiter
+from ydl_pool import ydl_pool
+from postprocess import post_processor
 from tray import SystemTrayIcon
 
+PROGRESS_INTERVAL_MS = 100 # UI refresh rate for download progress
+
 # Initialize Config (Global for theme setting before App init)
 config_manager = ConfigManager()
 ctk.set_appearance_mode(config_manager.get("theme"))
@@ -38,7 +48,13 @@ class App(ctk.CTk):
                 print(f"Could not set icon: {e}")    
 
         self.config_manager = config_manager # Use global instance
+        bandwidth_limiter.set_rate((self.config_manager.get("speed_limit") or 0) * 1024)
         self.history_manager = HistoryManager()
+        self.validator_store = ValidatorStore()
+        self.metadata_cache = MetadataCache()
+        self.download_archive = DownloadArchive()
+        self.download_cache = None
+        self.apply_cache_size()
         self.active_downloads = [] 
         self.selected_download = None
         self.selected_history_entries = [] # For history selection
@@ -50,6 +66,7 @@ class App(ctk.CTk):
 
         self.create_layout()
         self.show_view("Downloads")
+        self.progress_tick()
 
         # Background Server for Chrome Extension
         self.url_queue = queue.Queue()
@@ -101,6 +118,10 @@ class App(ctk.CTk):
         # Cancel
         self.btn_cancel = ctk.CTkButton(self.top_bar, text="Stop", image=self.icon_stop, compound="left", width=100, fg_color="#C0392B", hover_color="#E74C3C", command=self.cancel_selected, state="disabled")
         self.btn_cancel.pack(side="left", padx=10, pady=10)
+
+        # Pause / Resume
+        self.btn_pause = ctk.CTkButton(self.top_bar, text="Pause", width=100, fg_color="transparent", border_width=1, text_color=("gray10", "gray90"), command=self.toggle_pause_selected, state="disabled")
+        self.btn_pause.pack(side="left", padx=10, pady=10)
         
         # Settings
         self.btn_settings = ctk.CTkButton(self.top_bar, text="Settings", image=self.icon_settings, compound="left", width=100, fg_color="transparent", border_width=1, text_color=("gray10", "gray90"), command=self.open_settings)
@@ -170,8 +191,11 @@ class App(ctk.CTk):
     def update_cancel_button_state(self):
         if self.selected_download and self.current_view == "Downloads":
             self.btn_cancel.configure(state="normal")
+            paused = self.selected_download['downloader'].is_paused()
+            self.btn_pause.configure(state="normal", text="Resume" if paused else "Pause")
         else:
             self.btn_cancel.configure(state="disabled")
+            self.btn_pause.configure(state="disabled", text="Pause")
 
     def show_history(self, filter_type):
         self.history_control_bar = ctk.CTkFrame(self.content_area, height=40, fg_color="transparent")
@@ -247,18 +271,33 @@ class App(ctk.CTk):
             self.show_view(self.current_view)
 
     def open_add_dialog(self):
-        AddDownloadDialog(self, self.start_download_task, self.config_manager.get("default_path"))
+        AddDownloadDialog(self, self.start_download_task, self.config_manager.get("default_path"),
+                          media_profile=self.config_manager.get("media_profile"))
 
     def open_settings(self):
         SettingsDialog(self, self.config_manager, self.apply_settings)
 
     def apply_settings(self):
         ctk.set_appearance_mode(self.config_manager.get("theme"))
+        # Takes effect immediately for transfers already running
+        bandwidth_limiter.set_rate((self.config_manager.get("speed_limit") or 0) * 1024)
+        self.apply_cache_size()
+
+    def apply_cache_size(self):
+        max_size = int((self.config_manager.get("cache_size") or 0) * 1024 ** 3)
+        if self.download_cache:
+            self.download_cache.set_max_size(max_size) # 0 empties it
+        elif max_size:
+            self.download_cache = DownloadCache(max_size)
+        if not max_size:
+            self.download_cache = None
 
     def start_download_task(self, data):
         # Determine Downloader & Path
         if data.get('type') == 'File':
-            downloader = SegmentedFileDownloader()
+            downloader = SegmentedFileDownloader(speed_limit=data.get('speed_limit', 0) * 1024,
+                                                 validators=self.validator_store,
+                                                 cache=self.download_cache)
             # Categorize
             cat = detect_category(data['url'])
             if cat == 'Other': cat = 'Files' # Default folder for generic files
@@ -274,7 +313,13 @@ class App(ctk.CTk):
             data['path'] = os.path.join(data['path'], subfolder)
 
         else:
-            downloader = MediaDownloader(ffmpeg_path=self.ffmpeg_path)
+            downloader = MediaDownloader(ffmpeg_path=self.ffmpeg_path, speed_limit=data.get('speed_limit', 0) * 1024,
+                                         cache=self.download_cache,
+                                         metadata_cache=self.metadata_cache,
+                                         playlist_workers=self.config_manager.get("playlist_workers") or 1,
+                                         media_profile=data.get('media_profile') or self.config_manager.get("media_profile"),
+                                         avoid_transcoding=self.config_manager.get("avoid_transcoding"),
+                                         archive=self.download_archive)
             # Append subfolder based on format/playlist
             if data.get('playlist'):
                 data['path'] = os.path.join(data['path'], 'Playlists')
@@ -312,7 +357,6 @@ class App(ctk.CTk):
                 data['path'],
                 data['quality'],
                 data['format'],
-                progress_callback=lambda p, s, e: self.update_progress(download_obj, p, s, e),
                 completion_callback=lambda t: self.download_complete(download_obj, t),
                 error_callback=lambda m: self.download_error(download_obj, m),
                 title_callback=lambda t: self.update_title(download_obj, t)
@@ -322,10 +366,11 @@ class App(ctk.CTk):
             downloader.download(
                 data['url'],
                 data['path'],
-                progress_callback=lambda p, s, e: self.update_progress(download_obj, p, s, e),
                 completion_callback=lambda t: self.download_complete(download_obj, t),
                 error_callback=lambda m: self.download_error(download_obj, m),
-                title_callback=lambda t: self.update_title(download_obj, t)
+                title_callback=lambda t: self.update_title(download_obj, t),
+                checksum=data.get('checksum'),
+                mirrors=data.get('mirrors')
             )
 
     def update_title(self, download_obj, title):
@@ -342,21 +387,33 @@ class App(ctk.CTk):
             except:
                 pass
 
-    def update_progress(self, download_obj, progress, speed, eta):
-        # Throttle updates?
-        try:
-            self.after(0, lambda: self._update_ui_widget(download_obj, progress, speed, eta))
-        except:
-            pass
+    def progress_tick(self):
+        # One batched UI update for every active download, instead of a callback per chunk
+        if not self.is_running: return
+        for download_obj in self.active_downloads:
+            snapshot = download_obj['downloader'].get_progress()
+            if snapshot:
+                self._update_ui_widget(download_obj, *snapshot)
+        self.after(PROGRESS_INTERVAL_MS, self.progress_tick)
 
     def _update_ui_widget(self, download_obj, progress, speed, eta):
-        if not self.is_running: return
         if 'ui_widgets' in download_obj:
             try:
                 widgets = download_obj['ui_widgets']
                 widgets['progress'].set(progress)
-                widgets['status'].configure(text=f"Downloading... {int(progress*100)}%")
-                widgets['speed'].configure(text=f"{speed} | ETA: {eta}")
+                is_media = isinstance(download_obj['downloader'], MediaDownloader)
+                counts = download_obj['downloader'].playlist_counts() if is_media else None
+                items = f" ({counts[0]}/{counts[2]} items)" if counts else ""
+                if is_media and download_obj['downloader'].is_processing():
+                    # Downloaded, waiting for ffmpeg to convert it
+                    widgets['status'].configure(text=f"Processing...{items}")
+                    widgets['speed'].configure(text="")
+                elif download_obj['downloader'].is_paused():
+                    widgets['status'].configure(text=f"Paused {int(progress*100)}%{items}")
+                    widgets['speed'].configure(text="")
+                else:
+                    widgets['status'].configure(text=f"Downloading... {int(progress*100)}%{items}")
+                    widgets['speed'].configure(text=f"{speed} | ETA: {eta}")
             except:
                 pass # Widget might be destroyed if view changed
 
@@ -422,33 +479,38 @@ class App(ctk.CTk):
             self.selected_download['downloader'].cancel()
             # The error callback will handle the removal and UI update
             self.btn_cancel.configure(state="disabled")
+            self.btn_pause.configure(state="disabled")
+
+    def toggle_pause_selected(self):
+        if self.selected_download:
+            downloader = self.selected_download['downloader']
+            if downloader.is_paused():
+                downloader.resume()
+            else:
+                downloader.pause()
+            self.update_cancel_button_state()
 
     # --- History Actions ---
+    def find_media_file(self, entry):
+        # Try exact match first (generic file), then the media extensions we may have saved it with
+        base = os.path.join(entry.get('path', ''), entry.get('title', ''))
+        for ext in ('', '.mp3', '.mp4', '.m4a', '.opus', '.ogg', '.mkv'):
+            if os.path.exists(base + ext):
+                return base + ext
+        return None
+
     def play_file(self, entry):
         try:
-            # Try exact match first (generic file)
-            file_path = os.path.join(entry.get('path', ''), entry.get('title', ''))
-            if not os.path.exists(file_path):
-                 # Try adding extensions (legacy media)
-                 file_path = os.path.join(entry.get('path', ''), entry.get('title', '') + '.mp3')
-                 if not os.path.exists(file_path):
-                     file_path = os.path.join(entry.get('path', ''), entry.get('title', '') + '.mp4')
-            
-            if os.path.exists(file_path):
+            file_path = self.find_media_file(entry)
+            if file_path:
                 os.startfile(file_path)
         except Exception as e:
             print(f"Error: {e}")
 
     def show_in_explorer(self, entry):
         try:
-            # Try exact match first
-            file_path = os.path.join(entry.get('path', ''), entry.get('title', ''))
-            if not os.path.exists(file_path):
-                file_path = os.path.join(entry.get('path', ''), entry.get('title', '') + '.mp3')
-                if not os.path.exists(file_path):
-                    file_path = os.path.join(entry.get('path', ''), entry.get('title', '') + '.mp4')
-            
-            if os.path.exists(file_path):
+            file_path = self.find_media_file(entry)
+            if file_path:
                 subprocess.run(['explorer', '/select,', os.path.abspath(file_path)])
         except Exception as e:
             print(f"Error: {e}")
@@ -468,7 +530,8 @@ class App(ctk.CTk):
                     self.focus_force()
                     
                     # Open Add Dialog with URL
-                    AddDownloadDialog(self, self.start_download_task, self.config_manager.get("default_path"), initial_url=url)
+                    AddDownloadDialog(self, self.start_download_task, self.config_manager.get("default_path"), initial_url=url,
+                                      media_profile=self.config_manager.get("media_profile"))
         except queue.Empty:
             pass
         finally:
@@ -493,6 +556,10 @@ class App(ctk.CTk):
             self.tray_icon.stop()
         if self.server:
             self.server.stop() 
+        close_sessions()
+        ydl_pool.close_all()
+        post_processor.shutdown()
+        self.download_archive.close()
         
         try:
             self.destroy()
@@ -0,0 +1,64 @@
+import json
+import os
+
+class DownloadManifest:
+    """Sidecar file next to a partial download recording how far each segment got."""
+    SUFFIX = ".qdpart"
+
+    def __init__(self, filepath):
+        self.filename = filepath + self.SUFFIX
+        self.url = None
+        self.etag = None
+        self.last_modified = None
+        self.total_size = 0
+        self.segments = [] # [start, end, pos] per segment
+
+    @classmethod
+    def load(cls, filepath):
+        manifest = cls(filepath)
+        if not os.path.exists(manifest.filename) or not os.path.exists(filepath):
+            return None
+        try:
+            with open(manifest.filename, 'r') as f:
+                data = json.load(f)
+            manifest.url = data['url']
+            manifest.etag = data.get('etag')
+            manifest.last_modified = data.get('last_modified')
+            manifest.total_size = data['total_size']
+            manifest.segments = data['segments']
+            return manifest
+        except Exception as e:
+            print(f"Ignoring unreadable manifest {manifest.filename}: {e}")
+            return None
+
+    def matches(self, url, total_size, etag, last_modified):
+        if self.url != url or self.total_size != total_size:
+            return False
+        # Without a validator we can't tell whether the remote file changed
+        if not etag and not last_modified:
+            return False
+        return self.etag == etag and self.last_modified == last_modified
+
+    def save(self):
+        data = {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "total_size": self.total_size,
+            "segments": self.segments
+        }
+        # Write to a temp file and swap it in so a crash never leaves a torn manifest
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            print(f"Error saving manifest: {e}")
+
+    def remove(self):
+        try:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+        except Exception as e:
+            print(f"Error removing manifest: {e}")
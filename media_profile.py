@@ -0,0 +1,82 @@
+import threading
+from urllib.parse import urlsplit
+
+PROFILE_NAMES = ["Auto", "Light", "Balanced", "Fast"]
+DEFAULT_PROFILE = "Auto"
+
+# yt-dlp options per profile. http_chunk_size splits plain (non-fragmented) streams into
+# ranged requests, which keeps throttled servers such as YouTube at full speed.
+PROFILES = {
+    "Light": {'concurrent_fragment_downloads': 1, 'buffersize': 64 * 1024},
+    "Balanced": {'concurrent_fragment_downloads': 4, 'buffersize': 256 * 1024, 'http_chunk_size': 10 * 1024 * 1024},
+    "Fast": {'concurrent_fragment_downloads': 8, 'buffersize': 1024 * 1024, 'http_chunk_size': 10 * 1024 * 1024},
+}
+
+INITIAL_FRAGMENTS = 2
+MAX_FRAGMENTS = 16
+TUNE_MIN_GAIN = 0.1 # doubling the fragments must add at least 10% throughput
+MIN_SAMPLE_SECONDS = 3 # shorter fragmented downloads say too little about the link
+
+class FragmentTuner:
+    """
+    Picks the fragment concurrency per site for the Auto profile. yt-dlp can't change it
+    mid-download, so each fragmented download is a sample: the count doubles for the next
+    one while throughput keeps improving, and drops back and stays once it doesn't.
+    """
+    def __init__(self):
+        self.sites = {} # host -> {'fragments', 'best', 'settled'}
+        self.lock = threading.Lock()
+
+    def options(self, url):
+        with self.lock:
+            fragments = self._site(url)['fragments']
+        return {'concurrent_fragment_downloads': fragments, 'buffersize': 1024 * 1024, 'http_chunk_size': 10 * 1024 * 1024}
+
+    def report(self, url, fragments, throughput):
+        with self.lock:
+            site = self._site(url)
+            if site['settled'] or fragments != site['fragments']:
+                return # settled, or another download already moved it on
+            if throughput > site['best'] * (1 + TUNE_MIN_GAIN) and fragments < MAX_FRAGMENTS:
+                site['best'] = throughput
+                site['fragments'] = min(fragments * 2, MAX_FRAGMENTS)
+            else:
+                if throughput <= site['best']:
+                    site['fragments'] = max(INITIAL_FRAGMENTS, fragments // 2)
+                site['settled'] = True
+                print(f"Settled on {site['fragments']} fragments for {urlsplit(url).hostname}")
+
+    def back_off(self, url, fragments):
+        """The site answered 429 under this concurrency: halve it and stop growing."""
+        with self.lock:
+            site = self._site(url)
+            site['fragments'] = max(1, min(site['fragments'], fragments // 2))
+            site['settled'] = True
+
+    def _site(self, url):
+        host = urlsplit(url).hostname or url
+        return self.sites.setdefault(host, {'fragments': INITIAL_FRAGMENTS, 'best': 0, 'settled': False})
+
+def http_status(error):
+    """
+    HTTP status behind a yt-dlp error, None if it wasn't an HTTP error. DownloadError
+    keeps the original in exc_info, ExtractorError in cause.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, 'status', None) or getattr(error, 'code', None)
+        if isinstance(status, int) and 100 <= status < 600:
+            return status
+        exc_info = getattr(error, 'exc_info', None)
+        error = (exc_info[1] if exc_info else None) or getattr(error, 'cause', None) or error.__cause__ or error.__context__
+    return None
+
+def profile_options(profile, url):
+    """yt-dlp options for a media performance profile."""
+    if profile in PROFILES:
+        return dict(PROFILES[profile])
+    return fragment_tuner.options(url)
+
+# Shared by all media downloads, so what one download learns about a site carries over
+fragment_tuner = FragmentTuner()
@@ -0,0 +1,134 @@
+import copy
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+from utils import get_user_data_dir
+
+DEFAULT_TTL = 3 * 60 * 60 # seconds an extraction stays valid
+EXPIRY_MARGIN = 10 * 60 # refresh signed stream URLs this long before they run out
+MAX_MEMORY_ENTRIES = 64
+MAX_DISK_BYTES = 64 * 1024 * 1024
+
+def signed_url_expiry(info):
+    """Earliest expiry (unix time) found in the query of the info's stream URLs, e.g. YouTube's expire=."""
+    earliest = None
+    for fmt in info.get('formats') or [info]:
+        url = fmt.get('url') or ''
+        for name, value in parse_qsl(urlsplit(url).query):
+            if name.lower() in ('expire', 'expires') and value.isdigit():
+                earliest = min(earliest or int(value), int(value))
+    return earliest
+
+class MetadataCache:
+    """
+    Extracted media info (formats included), in memory and gzipped on disk, so adding
+    the same URL again skips extraction and goes straight to fetching.
+    An entry expires after the TTL or shortly before its signed stream URLs do,
+    whichever comes first.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, directory=None, max_memory_entries=MAX_MEMORY_ENTRIES, max_disk_bytes=MAX_DISK_BYTES):
+        self.ttl = ttl
+        self.directory = directory or os.path.join(get_user_data_dir(), 'metadata')
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict() # key -> (expires, info), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry:
+                self.memory.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+        expires, info = entry
+        if time.time() >= expires:
+            self.invalidate(key)
+            return None
+        # yt-dlp processes the info in place, so every download gets its own copy
+        return copy.deepcopy(info)
+
+    def put(self, key, info):
+        expires = time.time() + self.ttl
+        signed = signed_url_expiry(info)
+        if signed:
+            expires = min(expires, signed - EXPIRY_MARGIN)
+        if expires <= time.time():
+            return
+        self._remember(key, (expires, copy.deepcopy(info)))
+        # Write to a temp file of our own and swap it in: two downloads of one URL may save
+        # at the same time, and a crash mustn't leave a torn entry
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+                json.dump({'key': key, 'expires': expires, 'info': info}, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"Error saving metadata: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._trim_disk()
+
+    def invalidate(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('key') != key:
+                return None
+            return data['expires'], data['info']
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Truncated or corrupt (EOFError, zlib.error, bad JSON...): a miss, and gone for next time
+            print(f"Discarding unreadable metadata {os.path.basename(path)}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json.gz')
+
+    def _trim_disk(self):
+        # Oldest files go first; reading an entry doesn't refresh its file, so this is by age
+        try:
+            files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+            stats = sorted((os.stat(path).st_mtime, os.path.getsize(path), path) for path in files)
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,64 @@
+import random
+import threading
+
+MAX_MIRROR_FAILURES = 3 # errors before a mirror is dropped
+SLOW_MIRROR_RATIO = 0.1 # drop mirrors running at under a tenth of the fastest one
+MIN_SAMPLE_BYTES = 2 * 1024 * 1024 # measure at least this much before judging a mirror
+
+class Mirror:
+    def __init__(self, url, session, if_range=None):
+        self.url = url
+        self.session = session
+        self.if_range = if_range
+        self.bytes = 0
+        self.elapsed = 0.0 # summed over connections, so bytes/elapsed is per-connection speed
+        self.failures = 0
+        self.active = True
+
+    @property
+    def throughput(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0
+
+class MirrorSet:
+    """Spreads work units over mirrors of the same file, weighted by measured speed."""
+    def __init__(self, mirrors):
+        self.mirrors = mirrors
+        self.lock = threading.Lock()
+
+    def active(self):
+        return [m for m in self.mirrors if m.active]
+
+    def pick(self):
+        with self.lock:
+            active = self.active()
+            measured = [m.throughput for m in active if m.bytes >= MIN_SAMPLE_BYTES]
+            # Mirrors we haven't measured yet get the best known weight so they get tried
+            default = max(measured) if measured else 1
+            weights = [m.throughput if m.bytes >= MIN_SAMPLE_BYTES else default for m in active]
+            return random.choices(active, weights=weights)[0]
+
+    def record(self, mirror, nbytes, seconds):
+        with self.lock:
+            mirror.bytes += nbytes
+            mirror.elapsed += seconds
+            if mirror.bytes < MIN_SAMPLE_BYTES or len(self.active()) < 2:
+                return
+            best = max(m.throughput for m in self.active())
+            if mirror.throughput < best * SLOW_MIRROR_RATIO:
+                self._drop(mirror, "too slow")
+
+    def fail(self, mirror):
+        """Count an error against a mirror. Returns False if it was the last one left."""
+        with self.lock:
+            mirror.failures += 1
+            if not mirror.active:
+                return True # already dropped, the others carry on
+            if len(self.active()) < 2:
+                return False
+            if mirror.failures >= MAX_MIRROR_FAILURES:
+                self._drop(mirror, "too many errors")
+            return True
+
+    def _drop(self, mirror, reason):
+        mirror.active = False
+        print(f"Dropping mirror {mirror.url} ({reason})")
@@ -0,0 +1,107 @@
+import re
+import threading
+from urllib.parse import urlsplit
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Encoding': 'identity'
+}
+
+TIMEOUT = (10, 30) # connect, read (seconds)
+
+# Errors worth retrying: the connection or the server hiccuped, not the request itself
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.HTTPError, # raw socket reads raise these directly
+    ConnectionError,
+    TimeoutError,
+)
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+_sessions = {} # host -> (session, pool size)
+_sessions_lock = threading.Lock()
+
+_range_support = {} # host -> whether it honours Range requests
+_range_support_lock = threading.Lock()
+
+def _host(url):
+    return urlsplit(url).netloc.lower()
+
+def get_session(url, pool_size=8):
+    """
+    Get the keep-alive session shared by every download from this host.
+    The connection pool grows to the largest worker count asked for so far.
+    """
+    host = _host(url)
+    with _sessions_lock:
+        session, size = _sessions.get(host, (None, 0))
+        if session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+        if pool_size > size:
+            # Connections in the old adapter's pool are dropped, so only ever grow it
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            size = pool_size
+        _sessions[host] = (session, size)
+        return session
+
+def close_sessions():
+    with _sessions_lock:
+        for session, _ in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def is_transient_error(error):
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def parse_content_range(value):
+    """Parse 'bytes start-end/total' into (start, end, total); total is None for '*'."""
+    match = CONTENT_RANGE.fullmatch((value or "").strip())
+    if not match:
+        return None
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), None if total == '*' else int(total)
+
+def supports_ranges(session, url, headers=None):
+    """
+    Check whether the server really honours Range requests by asking for the first byte.
+    Accept-Ranges or a Content-Length alone prove nothing. The answer is cached per host.
+    """
+    host = _host(url)
+    with _range_support_lock:
+        if host in _range_support:
+            return _range_support[host]
+
+    if headers is not None and headers.get('Accept-Ranges') == 'none':
+        supported = False
+    else:
+        try:
+            with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT) as r:
+                content_range = parse_content_range(r.headers.get('Content-Range'))
+                supported = r.status_code == 206 and content_range is not None and content_range[:2] == (0, 0)
+        except requests.exceptions.RequestException as e:
+            # Don't remember a guess based on a network error
+            print(f"Range probe failed: {e}")
+            return False
+
+    set_range_support(url, supported)
+    return supported
+
+def known_range_support(url):
+    """What a previous download learned about this host: True, False or None if nothing yet."""
+    with _range_support_lock:
+        return _range_support.get(_host(url))
+
+def set_range_support(url, supported):
+    with _range_support_lock:
+        _range_support[_host(url)] = supported
@@ -0,0 +1,99 @@
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+AUDIO_ENCODERS = {'mp3': 'libmp3lame'}
+# Audio codecs that can be kept as they are, and the file type to copy them into
+PASSTHROUGH_AUDIO = {'mp4a': 'm4a', 'aac': 'm4a', 'opus': 'opus', 'mp3': 'mp3', 'vorbis': 'ogg'}
+
+def passthrough_audio(fmt, max_kbps=None):
+    """
+    File type a downloaded audio stream can be stream-copied into, or None if it needs
+    a transcode (unknown codec, or above max_kbps when a smaller file was asked for).
+    """
+    ext = PASSTHROUGH_AUDIO.get((fmt.get('acodec') or '').split('.')[0].lower())
+    if not ext or (max_kbps and fmt.get('abr') and fmt['abr'] > max_kbps):
+        return None
+    return ext
+
+def find_ffmpeg(location=None):
+    """The ffmpeg binary: location may be the binary itself or the folder holding it."""
+    if location and os.path.isfile(location):
+        return location
+    return shutil.which('ffmpeg', path=location) if location else shutil.which('ffmpeg')
+
+class PostProcessor:
+    """
+    CPU-bound ffmpeg work (audio transcodes) kept out of the download threads.
+    A download hands over its raw file and frees its network slot right away; at most
+    one ffmpeg per core runs at a time and the rest wait their turn.
+    """
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="postprocess")
+        self.running = set() # ffmpeg processes, killed on shutdown
+        self.lock = threading.Lock()
+
+    def extract_audio(self, source, codec, bitrate, ffmpeg_location=None, is_cancelled=None):
+        """Queue a transcode of source to codec at bitrate (kbps). Future of the new file's path."""
+        return self.pool.submit(self._convert, source, codec, ['-c:a', AUDIO_ENCODERS.get(codec, codec), '-b:a', f'{bitrate}k'],
+                                ffmpeg_location, is_cancelled)
+
+    def remux_audio(self, source, ext, ffmpeg_location=None, is_cancelled=None):
+        """Queue a copy of source's audio stream into an .ext file, without re-encoding."""
+        return self.pool.submit(self._convert, source, ext, ['-c:a', 'copy'], ffmpeg_location, is_cancelled)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            for process in self.running:
+                process.kill()
+
+    def _convert(self, source, ext, audio_args, ffmpeg_location, is_cancelled):
+        if is_cancelled and is_cancelled():
+            raise Exception("Download cancelled by user")
+        ffmpeg = find_ffmpeg(ffmpeg_location)
+        if not ffmpeg:
+            raise Exception("ffmpeg not found, it is needed to convert audio")
+
+        target = os.path.splitext(source)[0] + '.' + ext
+        if target == source:
+            return source # already in the requested format
+        tmp = os.path.splitext(source)[0] + '.temp.' + ext
+        command = [ffmpeg, '-y', '-nostdin', '-loglevel', 'error', '-i', source,
+                   '-vn', '-map_metadata', '0', *audio_args, tmp]
+        self._run(command, tmp, is_cancelled)
+        os.replace(tmp, target)
+        os.remove(source)
+        return target
+
+    def _run(self, command, output, is_cancelled):
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        with self.lock:
+            self.running.add(process)
+        try:
+            while True:
+                try:
+                    _, stderr = process.communicate(timeout=0.25)
+                    break
+                except subprocess.TimeoutExpired:
+                    if is_cancelled and is_cancelled():
+                        process.kill()
+                        process.communicate()
+                        raise Exception("Download cancelled by user")
+        except BaseException:
+            if os.path.exists(output):
+                os.remove(output)
+            raise
+        finally:
+            with self.lock:
+                self.running.discard(process)
+        if process.returncode != 0:
+            if os.path.exists(output):
+                os.remove(output)
+            raise Exception(f"ffmpeg failed: {stderr.decode(errors='replace').strip() or process.returncode}")
+
+# Shared by all media downloads, so transcodes never outnumber the cores
+post_processor = PostProcessor()
@@ -0,0 +1,27 @@
+import time
+from collections import deque
+
+class SpeedMeter:
+    """Transfer speed over a sliding window of (time, bytes) samples."""
+    def __init__(self, window=3.0):
+        self.window = window
+        self.samples = deque()
+
+    def update(self, total_bytes):
+        now = time.monotonic()
+        self.samples.append((now, total_bytes))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        first_time, first_bytes = self.samples[0]
+        if now <= first_time:
+            return 0
+        return (total_bytes - first_bytes) / (now - first_time)
+
+    def reset(self):
+        self.samples.clear()
+
+def format_speed(speed):
+    return f"{speed / 1024 / 1024:.2f} MiB/s"
+
+def format_eta(seconds):
+    return f"{int(seconds)}s"
@@ -0,0 +1,93 @@
+import threading
+import time
+
+BURST_SECONDS = 0.5 # how much unused allowance a download may save up
+MAX_SLEEP = 0.25 # re-check rate changes and cancellation at least this often
+
+class Throttle:
+    """Token bucket for one download. Its rate is assigned by the BandwidthLimiter."""
+    def __init__(self, limiter, cap=0):
+        self.limiter = limiter
+        self.cap = cap # own limit in bytes/s, 0 = none
+        self.rate = 0 # effective limit in bytes/s, 0 = unlimited
+        self.paused = False # a paused download leaves its share to the others
+        self.tokens = 0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount, is_cancelled=None):
+        """Block until `amount` bytes may be passed on. Returns early on cancel."""
+        with self.lock:
+            rate = self.rate
+            if not rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last) * rate, rate * BURST_SECONDS)
+            self.last = now
+            # Go into debt and sleep it off, so large blocks don't wait for a full bucket
+            self.tokens -= amount
+            deadline = now + (-self.tokens / rate if self.tokens < 0 else 0)
+
+        while time.monotonic() < deadline:
+            if is_cancelled and is_cancelled():
+                return
+            if self.rate != rate:
+                # Limit changed while we waited: re-balance the remaining debt at the new rate
+                with self.lock:
+                    left = deadline - time.monotonic()
+                    if not self.rate:
+                        return
+                    deadline = time.monotonic() + max(0, left) * rate / self.rate
+                    rate = self.rate
+            time.sleep(min(MAX_SLEEP, max(0, deadline - time.monotonic())))
+
+class BandwidthLimiter:
+    """
+    Process-wide bandwidth cap shared by every active download.
+    The global rate is split evenly between running downloads. A download whose own
+    cap is below its share gets its cap, and what it leaves over goes to the others.
+    """
+    def __init__(self, rate=0):
+        self.rate = rate # bytes/s, 0 = unlimited
+        self.throttles = []
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self._rebalance()
+
+    def register(self, cap=0):
+        throttle = Throttle(self, cap)
+        with self.lock:
+            self.throttles.append(throttle)
+            self._rebalance()
+        return throttle
+
+    def unregister(self, throttle):
+        with self.lock:
+            if throttle in self.throttles:
+                self.throttles.remove(throttle)
+                self._rebalance()
+
+    def set_paused(self, throttle, paused):
+        with self.lock:
+            throttle.paused = paused
+            self._rebalance()
+
+    def _rebalance(self):
+        running = [t for t in self.throttles if not t.paused]
+        if not self.rate:
+            for throttle in running:
+                throttle.rate = throttle.cap
+            return
+        # Water-filling: settle the lowest caps first, then split the rest evenly
+        left = self.rate
+        running.sort(key=lambda t: t.cap or float('inf'))
+        for i, throttle in enumerate(running):
+            share = left / (len(running) - i)
+            throttle.rate = throttle.cap if throttle.cap and throttle.cap < share else share
+            left -= throttle.rate
+
+# Shared by all downloaders in the process
+bandwidth_limiter = BandwidthLimiter()
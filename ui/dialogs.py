@@ -1,7 +1,9 @@
 import customtkinter as ctk
-from tkinter import filedialog, Menu
+from tkinter import filedialog, Menu, messagebox
 import os
-from utils import resource_path, detect_download_type
+from utils import resource_path, detect_download_type, parse_speed_limit, parse_cache_size
+from checksum import parse_checksum
+from media_profile import PROFILE_NAMES
 
 class SettingsDialog(ctk.CTkToplevel):
     def __init__(self, parent, config_manager, callback):
@@ -9,7 +11,7 @@ class SettingsDialog(ctk.CTkToplevel):
         self.config_manager = config_manager
         self.callback = callback
         self.title("Settings")
-        self.geometry("400x250")
+        self.geometry("400x480")
         self.resizable(False, False)
         
         # Set icon
@@ -49,9 +51,40 @@ class SettingsDialog(ctk.CTkToplevel):
         self.theme_menu = ctk.CTkOptionMenu(self, variable=self.theme_var, values=["System", "Dark", "Light"])
         self.theme_menu.grid(row=1, column=1, padx=10, pady=10, sticky="ew")
 
+        # Global Speed Limit
+        ctk.CTkLabel(self, text="Speed Limit (KB/s):", text_color=("gray10", "gray90")).grid(row=2, column=0, padx=10, pady=10, sticky="e")
+        self.speed_limit_entry = ctk.CTkEntry(self, placeholder_text="0 = unlimited")
+        self.speed_limit_entry.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
+        if self.config_manager.get("speed_limit"):
+            self.speed_limit_entry.insert(0, str(self.config_manager.get("speed_limit")))
+
+        # Shared download cache
+        ctk.CTkLabel(self, text="Cache Size (GB):", text_color=("gray10", "gray90")).grid(row=3, column=0, padx=10, pady=10, sticky="e")
+        self.cache_size_entry = ctk.CTkEntry(self, placeholder_text="0 = off")
+        self.cache_size_entry.grid(row=3, column=1, padx=10, pady=10, sticky="ew")
+        if self.config_manager.get("cache_size"):
+            self.cache_size_entry.insert(0, str(self.config_manager.get("cache_size")))
+
+        # Parallel playlist items
+        ctk.CTkLabel(self, text="Playlist Workers:", text_color=("gray10", "gray90")).grid(row=4, column=0, padx=10, pady=10, sticky="e")
+        self.playlist_workers_var = ctk.StringVar(value=str(self.config_manager.get("playlist_workers")))
+        self.playlist_workers_menu = ctk.CTkOptionMenu(self, variable=self.playlist_workers_var, values=["1", "2", "3", "4", "6", "8"])
+        self.playlist_workers_menu.grid(row=4, column=1, padx=10, pady=10, sticky="ew")
+
+        # Fragment concurrency and chunking for media downloads
+        ctk.CTkLabel(self, text="Media Profile:", text_color=("gray10", "gray90")).grid(row=5, column=0, padx=10, pady=10, sticky="e")
+        self.media_profile_var = ctk.StringVar(value=self.config_manager.get("media_profile"))
+        self.media_profile_menu = ctk.CTkOptionMenu(self, variable=self.media_profile_var, values=PROFILE_NAMES)
+        self.media_profile_menu.grid(row=5, column=1, padx=10, pady=10, sticky="ew")
+
+        # Stream-copy media when the source codec already fits
+        self.avoid_transcoding_var = ctk.BooleanVar(value=self.config_manager.get("avoid_transcoding"))
+        ctk.CTkCheckBox(self, text="Avoid transcoding (keep original audio codec)", variable=self.avoid_transcoding_var,
+                        text_color=("gray10", "gray90")).grid(row=6, column=1, padx=10, pady=10, sticky="w")
+
         # Buttons
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
-        btn_frame.grid(row=2, column=0, columnspan=3, padx=10, pady=30)
+        btn_frame.grid(row=7, column=0, columnspan=3, padx=10, pady=30)
         
         ctk.CTkButton(btn_frame, text="Save", command=self.save_settings).pack(side="left", padx=10)
         ctk.CTkButton(btn_frame, text="Cancel", fg_color="red", border_width=1, command=self.destroy).pack(side="left", padx=10)
@@ -65,17 +98,23 @@ class SettingsDialog(ctk.CTkToplevel):
     def save_settings(self):
         self.config_manager.set("default_path", self.path_entry.get())
         self.config_manager.set("theme", self.theme_var.get())
+        self.config_manager.set("speed_limit", parse_speed_limit(self.speed_limit_entry.get()))
+        self.config_manager.set("cache_size", parse_cache_size(self.cache_size_entry.get()))
+        self.config_manager.set("playlist_workers", int(self.playlist_workers_var.get()))
+        self.config_manager.set("media_profile", self.media_profile_var.get())
+        self.config_manager.set("avoid_transcoding", self.avoid_transcoding_var.get())
         self.callback()
         self.destroy()
 
 class AddDownloadDialog(ctk.CTkToplevel):
-    def __init__(self, parent, callback, default_path, initial_url=None):
+    def __init__(self, parent, callback, default_path, initial_url=None, media_profile="Auto"):
         super().__init__(parent, fg_color=("#F5F5F5", "#1a1a1a"))
         self.callback = callback
         self.default_path = default_path
+        self.media_profile = media_profile
         self.initial_url = initial_url
         self.title("Add Download")
-        self.geometry("500x350")
+        self.geometry("500x510")
         self.resizable(False, False)
         
         # Set icon
@@ -166,9 +205,43 @@ class AddDownloadDialog(ctk.CTkToplevel):
         self.playlist_var = ctk.BooleanVar(value=False)
         ctk.CTkCheckBox(self, text="Download Playlist", variable=self.playlist_var, text_color=("gray10", "gray90")).grid(row=3, column=1, padx=10, pady=5, sticky="w")
 
+        # Per-download Speed Limit (on top of the global one from Settings)
+        ctk.CTkLabel(self, text="Limit (KB/s):", text_color=("gray10", "gray90")).grid(row=4, column=0, padx=10, pady=5, sticky="e")
+        self.speed_limit_entry = ctk.CTkEntry(self, placeholder_text="0 = no extra limit")
+        self.speed_limit_entry.grid(row=4, column=1, padx=10, pady=5, sticky="w")
+
+        # Expected Checksum (File downloads only)
+        self.lbl_checksum = ctk.CTkLabel(self, text="Checksum:", text_color=("gray10", "gray90"))
+        self.lbl_checksum.grid(row=5, column=0, padx=10, pady=5, sticky="e")
+        self.checksum_entry = ctk.CTkEntry(self, placeholder_text="sha256:... (optional)")
+        self.checksum_entry.grid(row=5, column=1, padx=10, pady=5, sticky="ew")
+
+        # Mirrors of the same file (File downloads only)
+        self.lbl_mirrors = ctk.CTkLabel(self, text="Mirrors:", text_color=("gray10", "gray90"))
+        self.lbl_mirrors.grid(row=6, column=0, padx=10, pady=5, sticky="e")
+        self.mirrors_entry = ctk.CTkEntry(self, placeholder_text="Extra URLs, space separated (optional)")
+        self.mirrors_entry.grid(row=6, column=1, padx=10, pady=5, sticky="ew")
+
+        self.file_only_widgets = [self.lbl_checksum, self.checksum_entry, self.lbl_mirrors, self.mirrors_entry]
+        if self.type_var.get() != "File":
+            for widget in self.file_only_widgets:
+                widget.grid_remove()
+
+        # Media performance profile, defaults to the one from Settings (Media downloads only)
+        self.lbl_profile = ctk.CTkLabel(self, text="Profile:", text_color=("gray10", "gray90"))
+        self.lbl_profile.grid(row=7, column=0, padx=10, pady=5, sticky="e")
+        self.profile_var = ctk.StringVar(value=self.media_profile)
+        self.profile_menu = ctk.CTkOptionMenu(self, variable=self.profile_var, values=PROFILE_NAMES)
+        self.profile_menu.grid(row=7, column=1, padx=10, pady=5, sticky="w")
+
+        self.media_only_widgets = [self.lbl_profile, self.profile_menu]
+        if self.type_var.get() == "File":
+            for widget in self.media_only_widgets:
+                widget.grid_remove()
+
         # Buttons
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
-        btn_frame.grid(row=4, column=0, columnspan=3, padx=10, pady=20)
+        btn_frame.grid(row=8, column=0, columnspan=3, padx=10, pady=20)
         
         ctk.CTkButton(btn_frame, text="Start Download", command=self.start_download).pack(side="left", padx=10)
         ctk.CTkButton(btn_frame, text="Cancel", fg_color="red", border_width=1, command=self.destroy).pack(side="left", padx=10)
@@ -216,6 +289,15 @@ class AddDownloadDialog(ctk.CTkToplevel):
         
         if not url:
             return
+
+        is_file = self.type_var.get() == "File"
+        checksum = self.checksum_entry.get().strip() if is_file else ""
+        mirrors = [m for m in self.mirrors_entry.get().split() if self.is_valid_link(m)] if is_file else []
+        try:
+            parse_checksum(checksum)
+        except ValueError as e:
+            messagebox.showerror("Invalid Checksum", str(e), parent=self)
+            return
             
         data = {
             "url": url,
@@ -223,7 +305,11 @@ class AddDownloadDialog(ctk.CTkToplevel):
             "type": self.type_var.get(),
             "format": self.format_var.get(),
             "quality": self.quality_var.get(),
-            "playlist": self.playlist_var.get()
+            "playlist": self.playlist_var.get(),
+            "speed_limit": parse_speed_limit(self.speed_limit_entry.get()),
+            "checksum": checksum,
+            "mirrors": mirrors,
+            "media_profile": None if is_file else self.profile_var.get()
         }
         self.callback(data)
         self.destroy()
@@ -244,9 +330,17 @@ class AddDownloadDialog(ctk.CTkToplevel):
             self.format_switch.pack_forget()
             self.lbl_quality.pack_forget()
             self.quality_menu.pack_forget()
+            for widget in self.file_only_widgets:
+                widget.grid()
+            for widget in self.media_only_widgets:
+                widget.grid_remove()
         else:
             # Show Format and Quality
             self.lbl_format.pack(side="left", padx=5)
             self.format_switch.pack(side="left", padx=5)
             self.lbl_quality.pack(side="left", padx=(15, 5))
             self.quality_menu.pack(side="left", padx=5)
+            for widget in self.file_only_widgets:
+                widget.grid_remove()
+            for widget in self.media_only_widgets:
+                widget.grid()
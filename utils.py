@@ -77,3 +77,17 @@ def detect_category(filename, media_type=None):
     if media_type == 'Video': return 'Video'
     
     return 'Other'
+
+def parse_cache_size(text):
+    """Parse a cache size in GB typed by the user. Anything invalid turns the cache off (0)."""
+    try:
+        return max(0.0, float(text.strip() or 0))
+    except ValueError:
+        return 0
+
+def parse_speed_limit(text):
+    """Parse a KB/s limit typed by the user. Anything invalid means unlimited (0)."""
+    try:
+        return max(0, int(float(text.strip() or 0)))
+    except ValueError:
+        return 0
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+from utils import get_user_data_dir
+
+MAX_ENTRIES = 1000 # oldest URLs are forgotten first
+
+class ValidatorStore:
+    """
+    Remembers the validators (ETag, Last-Modified, size) of completed file downloads,
+    so downloading the same URL again can be answered with a 304 instead of the body.
+    """
+    def __init__(self, filename="validators.json"):
+        self.filename = os.path.join(get_user_data_dir(), filename)
+        self.lock = threading.Lock() # downloads finish on their own threads
+        self.entries = self.load_entries()
+
+    def load_entries(self):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'r') as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def save_entries(self):
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(self.entries, f, indent=4)
+        except Exception as e:
+            print(f"Error saving validators: {e}")
+
+    def lookup(self, url, output_path):
+        """The entry for url if its file is still in output_path, untouched since it was downloaded."""
+        with self.lock:
+            entry = self.entries.get(url)
+        if not entry or os.path.dirname(entry['path']) != os.path.abspath(output_path):
+            return None
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+            return None
+        if os.path.exists(entry['path'] + '.qdpart'):
+            return None # a later download of it was interrupted
+        return entry
+
+    def record(self, url, path, headers, size):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        with self.lock:
+            self.entries.pop(url, None) # re-insert so it counts as the newest
+            if not etag and not last_modified:
+                self.save_entries()
+                return # nothing to revalidate against
+            self.entries[url] = {
+                'path': os.path.abspath(path),
+                'size': size,
+                'mtime': os.stat(path).st_mtime,
+                'etag': etag,
+                'last_modified': last_modified,
+            }
+            while len(self.entries) > MAX_ENTRIES:
+                self.entries.pop(next(iter(self.entries)))
+            self.save_entries()
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def matches(self, entry, size, headers):
+        """True if a full response describes the same file (for servers that ignore conditionals)."""
+        if size != entry['size']:
+            return False
+        etag = headers.get('ETag')
+        if etag and entry.get('etag'):
+            # Weak ETags are fine here, we only compare
+            return etag.removeprefix('W/') == entry['etag'].removeprefix('W/')
+        last_modified = headers.get('Last-Modified')
+        return bool(last_modified) and last_modified == entry.get('last_modified')
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+import yt_dlp
+from utils import get_user_data_dir
+
+MAX_IDLE = 4 # idle YoutubeDL instances kept around, across all option sets
+
+class _PooledYoutubeDL:
+    """A YoutubeDL whose hooks forward to whichever download is currently using it."""
+    def __init__(self, ydl_opts, cookiejar=None):
+        self.progress_hook = None
+        self.postprocessor_hook = None
+        opts = dict(ydl_opts,
+                    progress_hooks=[self._on_progress],
+                    postprocessor_hooks=[self._on_postprocess])
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        if cookiejar is not None:
+            # YoutubeDL loads its jar lazily on first use; setting it first makes every request use this one
+            self.ydl.cookiejar = cookiejar
+
+    def _on_progress(self, d):
+        if self.progress_hook:
+            self.progress_hook(d)
+
+    def _on_postprocess(self, d):
+        if self.postprocessor_hook:
+            self.postprocessor_hook(d)
+
+    def close(self):
+        try:
+            self.ydl.__exit__(None, None, None) # saves cookies and closes its HTTP handlers
+        except Exception as e:
+            print(f"Error closing YoutubeDL: {e}")
+
+class YoutubeDLPool:
+    """
+    Long-lived YoutubeDL instances keyed by their options, so back-to-back downloads
+    from the same site skip extractor setup and keep per-site state (tokens, player JS).
+    All instances share one cookie jar (saved to one cookie file) and one on-disk
+    cache directory.
+    An instance serves one download at a time.
+    """
+    def __init__(self, max_idle=MAX_IDLE):
+        self.max_idle = max_idle
+        self.idle = [] # (key, _PooledYoutubeDL), most recently used last
+        self.cookiejars = {} # cookie file -> the jar all instances using it share
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def get(self, ydl_opts, progress_hook=None, postprocessor_hook=None):
+        opts = dict(ydl_opts)
+        data_dir = get_user_data_dir()
+        opts.setdefault('cachedir', os.path.join(data_dir, 'yt-dlp-cache'))
+        opts.setdefault('cookiefile', os.path.join(data_dir, 'cookies.txt'))
+        key = json.dumps(opts, sort_keys=True, default=str)
+
+        with self.lock:
+            pooled = next((p for k, p in reversed(self.idle) if k == key), None)
+            if pooled:
+                self.idle = [(k, p) for k, p in self.idle if p is not pooled]
+        if pooled is None:
+            cookiefile = opts['cookiefile']
+            with self.lock:
+                cookiejar = self.cookiejars.get(cookiefile)
+            pooled = _PooledYoutubeDL(opts, cookiejar)
+            if cookiejar is None:
+                with self.lock:
+                    # The first instance loads the file; everyone after it shares that jar
+                    pooled.ydl.cookiejar = self.cookiejars.setdefault(cookiefile, pooled.ydl.cookiejar)
+
+        pooled.progress_hook = progress_hook
+        pooled.postprocessor_hook = postprocessor_hook
+        try:
+            yield pooled.ydl
+        except BaseException:
+            # yt-dlp may have been stopped half-way (cancel, pause, error): don't reuse it
+            pooled.close()
+            raise
+        pooled.progress_hook = pooled.postprocessor_hook = None
+        with self.lock:
+            # Keep the file current for the next start of the app
+            try:
+                pooled.ydl.save_cookies()
+            except Exception as e:
+                print(f"Error saving cookies: {e}")
+            self.idle.append((key, pooled))
+            evicted = self.idle[:-self.max_idle] if len(self.idle) > self.max_idle else []
+            self.idle = self.idle[len(evicted):]
+        for _, p in evicted:
+            p.close()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for _, pooled in idle:
+            pooled.close()
+
+# Shared by all media downloads in the process
+ydl_pool = YoutubeDLPool()